@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Benchmark: pair deduplication in write_sentence_pairs
+
+Generates synthetic matching links (Tatoeba-sized string IDs, most pairs present
+in both directions like in links.csv) and compares the memory and time of:
+  - a set of tuple(sorted([sid1, sid2])) keys (the previous implementation),
+  - a set of packed 64-bit int keys,
+  - id_sets.PairKeySet (packed keys in a uint64 open-addressing table),
+  - np.unique over a packed uint64 array, built in bulk (if NumPy is installed).
+Memory is measured with tracemalloc in a separate run (tracing slows allocation
+down): "kept" is what the structure holds once done, "peak" includes the transient
+copies made while it grows. The string IDs are produced on the fly, as when
+streaming links.csv, so the strings kept alive by tuple keys are counted.
+
+Usage:
+    python3 bench_pair_dedup.py --pairs 2000000
+"""
+
+import argparse
+import random
+import time
+import tracemalloc
+from array import array
+
+from id_sets import PairKeySet
+
+def make_links(pairs, seed=0):
+    rnd = random.Random(seed)
+    links = array('q')
+    for _ in range(pairs):
+        sid1, sid2 = rnd.randint(1, 13000000), rnd.randint(1, 13000000)
+        links.extend((sid1, sid2))
+        if rnd.random() < 0.9:
+            links.extend((sid2, sid1))
+    return links
+
+def iter_str_links(links):
+    for i in range(0, len(links), 2):
+        yield str(links[i]), str(links[i + 1])
+
+def dedup_tuples(links):
+    seen = set()
+    for sid1, sid2 in links:
+        key = tuple(sorted([sid1, sid2]))
+        if key in seen:
+            continue
+        seen.add(key)
+    return seen
+
+def dedup_ints(links):
+    seen = set()
+    for sid1, sid2 in links:
+        a, b = int(sid1), int(sid2)
+        key = a << 32 | b if a < b else b << 32 | a
+        if key in seen:
+            continue
+        seen.add(key)
+    return seen
+
+def dedup_pair_key_set(links):
+    seen = PairKeySet()
+    for sid1, sid2 in links:
+        seen.add(int(sid1), int(sid2))
+    return seen
+
+def dedup_numpy(links):
+    import numpy as np
+    ids = np.fromiter((int(sid) for link in links for sid in link), dtype=np.uint64).reshape(-1, 2)
+    keys = np.minimum(ids[:, 0], ids[:, 1]) << np.uint64(32) | np.maximum(ids[:, 0], ids[:, 1])
+    return np.unique(keys)
+
+def measure(dedup, links):
+    start = time.perf_counter()
+    count = len(dedup(iter_str_links(links)))
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    seen = dedup(iter_str_links(links))
+    kept, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del seen
+    return count, elapsed, kept, peak
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pair deduplication structures.")
+    parser.add_argument("--pairs", type=int, default=1000000, help="Number of distinct synthetic pairs (default: 1000000)")
+    args = parser.parse_args()
+
+    links = make_links(args.pairs)
+    print(f"Synthetic links: {len(links) // 2} matching links.")
+    methods = [("set of tuples", dedup_tuples), ("set of ints", dedup_ints), ("PairKeySet", dedup_pair_key_set)]
+    try:
+        import numpy  # noqa: F401
+        methods.append(("np.unique", dedup_numpy))
+    except ImportError:
+        print("NumPy not installed: skipping np.unique.")
+    counts = set()
+    for name, dedup in methods:
+        count, elapsed, kept, peak = measure(dedup, links)
+        counts.add(count)
+        print(f"{name:14}: {count} pairs in {elapsed:.2f}s, kept {kept / 2**20:.1f} MiB "
+              f"({kept / count:.0f} bytes/pair), peak {peak / 2**20:.1f} MiB")
+    if len(counts) != 1:
+        raise Exception("Pair counts differ between the methods.")
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Benchmark: single-threaded vs. parallel block-level bz2 decoding
+
+Builds a synthetic sentences.tar.bz2 (Tatoeba layout: id, lang, text separated by
+tabs) in a temporary directory, then times a full pass of extractor.iter_sentences
+with the standard "r:bz2" decoder and with parallel_bz2.
+
+Usage:
+    python3 bench_parallel_bz2.py --rows 2000000 --workers 8
+"""
+
+import argparse
+import io
+import os
+import random
+import tarfile
+import tempfile
+import time
+
+from extractor import iter_sentences
+
+def make_sentences_archive(path, rows, seed=0):
+    rnd = random.Random(seed)
+    langs = ["kab", "eng", "fra", "deu", "ara", "spa", "rus", "ber"]
+    words = ["azul", "tanemmirt", "hello", "world", "bonjour", "amek", "tettiliḍ", "ɣef", "Ɛli"]
+    lines = []
+    for sid in range(1, rows + 1):
+        text = " ".join(rnd.choice(words) for _ in range(rnd.randint(3, 12)))
+        lines.append(f"{sid}\t{rnd.choice(langs)}\t{text}\n")
+    data = "".join(lines).encode("utf-8")
+    with tarfile.open(path, "w:bz2") as tar:
+        info = tarfile.TarInfo("sentences.csv")
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    return len(data)
+
+def time_pass(path, workers):
+    start = time.perf_counter()
+    count = sum(1 for _ in iter_sentences(path, use_cache=False, workers=workers))
+    return count, time.perf_counter() - start
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark parallel bz2 decoding of a synthetic archive.")
+    parser.add_argument("--rows", type=int, default=1000000, help="Number of synthetic sentences (default: 1000000)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Worker processes for the parallel decoder (default: one per CPU)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sentences.tar.bz2")
+        raw_size = make_sentences_archive(path, args.rows)
+        print(f"Synthetic archive: {args.rows} rows, {raw_size} bytes raw, "
+              f"{os.path.getsize(path)} bytes compressed.")
+        serial_count, serial_time = time_pass(path, 1)
+        print(f"r:bz2 (1 thread)      : {serial_count} rows in {serial_time:.2f}s")
+        parallel_count, parallel_time = time_pass(path, args.workers)
+        print(f"parallel_bz2 ({args.workers} workers): {parallel_count} rows in {parallel_time:.2f}s")
+        if serial_count != parallel_count:
+            raise Exception("Row counts differ between the two decoders.")
+        print(f"Speed-up: {serial_time / parallel_time:.2f}x")
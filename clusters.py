@@ -0,0 +1,79 @@
+# clusters.py
+"""
+Translation Clusters
+
+Instead of one row per translation pair, groups the sentences of the requested
+languages into clusters of equivalent sentences: the connected components of the
+pivot–partner pairs matched by planner.collect_pairs, i.e. of the links between
+the pivot language and one of the partner languages. Links between two partner
+languages are ignored: the per-language exports do not have them, and the full
+archive and the per-language exports must give the same clusters. A kab sentence
+with five English translations becomes one record instead of five rows.
+
+The clusters are built from the pairs already in memory, without reading the
+exports again: each pair is merged into an array-backed union-find (one uint32
+parent per sentence ID), and the members are then grouped by their root. The
+output is JSON Lines, with one object per cluster mapping each language to the
+texts of its members:
+
+    {"kab": ["Azul."], "eng": ["Hello.", "Hi."]}
+
+Clusters come in order of their lowest sentence ID, and members in ID order
+within each language. Clusters whose members are all in one language are skipped.
+"""
+
+import json
+
+from id_sets import UnionFind
+
+def lang_index(sid, bitmaps):
+    """Return the index of the first ID collection in bitmaps that holds sid, or -1."""
+    for i, ids in enumerate(bitmaps):
+        if sid in ids:
+            return i
+    return -1
+
+def group_clusters(union_find, members):
+    """
+    Group members, an iterable of (lang, sentence IDs), by cluster. Returns a list of
+    {lang: [sentence IDs]} dicts with members in at least two languages, ordered by
+    lowest sentence ID.
+    """
+    clusters = {}
+    for lang, sids in members:
+        for sid in sids:
+            clusters.setdefault(union_find.find(sid), {}).setdefault(lang, []).append(sid)
+    grouped = []
+    for root in sorted(clusters):
+        cluster = clusters[root]
+        if len(cluster) >= 2:
+            for sids in cluster.values():
+                sids.sort()
+            grouped.append(cluster)
+    return grouped
+
+def write_clusters(clusters, text, langs, output_filename):
+    """
+    Write clusters (from group_clusters) as JSON Lines, languages in the order of
+    langs; text(lang, sid) returns the text of a sentence. Returns the number of clusters.
+    """
+    with open(output_filename, "w", encoding="utf-8") as f_out:
+        for cluster in clusters:
+            record = {lang: [text(lang, sid) for sid in cluster[lang]] for lang in langs if lang in cluster}
+            f_out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    print(f"Wrote {len(clusters)} translation clusters to {output_filename}.")
+    return len(clusters)
+
+def write_pivot_clusters(texts, pairs, pivot_lang, partner_langs, output_filename):
+    """
+    Write the translation clusters of the {lang: SentenceTexts} and
+    {partner_lang: [(partner_sid, pivot_sid)]} returned by planner.collect_pairs.
+    Returns the number of clusters.
+    """
+    langs = [pivot_lang] + list(partner_langs)
+    union_find = UnionFind()
+    for lang in partner_langs:
+        for sid, pivot_sid in pairs[lang]:
+            union_find.union(sid, pivot_sid)
+    clusters = group_clusters(union_find, [(lang, texts[lang]) for lang in langs])
+    return write_clusters(clusters, lambda lang, sid: texts[lang].text(sid), langs, output_filename)
@@ -0,0 +1,234 @@
+# delta.py
+"""
+Incremental Updates Between Tatoeba Snapshots
+
+A run with get_tatoeba_corpus.py --delta keeps a small index of the snapshot it
+processed in <output_dir>/snapshot_index/:
+
+    sentences.{ids,langs,hashes}.bin
+                      the sorted sentence IDs of the requested languages, with their
+                      language and a 64-bit hash of their text (13 bytes per sentence)
+    pairs_<lang>.bin  the sorted (lower ID << 32 | higher ID) keys of the pairs
+                      matched for each partner language
+    word_counts.tsv   the word frequencies of the fixed pivot text (for the stopwords)
+    meta.json         languages, fix mapping and output settings of that run
+
+On the next snapshot, the new index is built while the sentences are loaded, and
+both indexes are compared by a single sorted merge: sentences added, removed or
+edited (same ID, different hash), and pair links added or removed. The changes go
+to delta_report.tsv. When nothing changed, the outputs are left as they are.
+Otherwise only the changed lines are redone: fixed lines are reused for every line
+of the pivot text already in the previous run, and the word frequencies are
+updated by the lines that appeared or disappeared instead of re-tokenizing the
+whole corpus.
+"""
+
+import hashlib
+import json
+import os
+import sys
+from array import array
+from collections import Counter
+
+import fixer
+from id_sets import pair_key
+from kab_stopwords import count_words
+
+INDEX_DIR_NAME = "snapshot_index"
+REPORT_NAME = "delta_report.tsv"
+
+def text_hash(text):
+    """64-bit hash of a sentence text."""
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), "little")
+
+def _write_array(path, values):
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    with open(path, "wb") as f:
+        values.tofile(f)
+
+def _read_array(path, typecode, count):
+    values = array(typecode)
+    with open(path, "rb") as f:
+        values.fromfile(f, count)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+class SnapshotIndex:
+    """Sentence hashes and matched pair keys of one snapshot (see the module docstring)."""
+
+    def __init__(self, langs, ids, lang_numbers, hashes, pair_keys, meta=None, word_counts=None):
+        self.langs = langs                # language of lang_numbers[i] is langs[lang_numbers[i]]
+        self.ids = ids                    # array('I'), sorted
+        self.lang_numbers = lang_numbers  # array('B')
+        self.hashes = hashes              # array('Q')
+        self.pair_keys = pair_keys        # {partner lang: sorted array('Q')}
+        self.meta = meta or {}
+        self.word_counts = word_counts
+
+    @classmethod
+    def build(cls, texts, pairs, meta=None):
+        """Index the {lang: SentenceTexts} and {lang: [(sid, pivot_sid)]} of planner.collect_pairs."""
+        langs = list(texts)
+        entries = sorted((sid, number, text_hash(texts[lang].text(sid)))
+                         for number, lang in enumerate(langs) for sid in texts[lang])
+        pair_keys = {lang: array('Q', sorted({pair_key(sid, pivot_sid) for sid, pivot_sid in lang_pairs}))
+                     for lang, lang_pairs in pairs.items()}
+        return cls(langs, array('I', (entry[0] for entry in entries)),
+                   array('B', (entry[1] for entry in entries)),
+                   array('Q', (entry[2] for entry in entries)), pair_keys, meta)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        meta_path = os.path.join(directory, "meta.json")
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        for name, values in (("ids", self.ids), ("langs", self.lang_numbers), ("hashes", self.hashes)):
+            _write_array(os.path.join(directory, f"sentences.{name}.bin"), values)
+        for lang, keys in self.pair_keys.items():
+            _write_array(os.path.join(directory, f"pairs_{lang}.bin"), keys)
+        if self.word_counts is not None:
+            with open(os.path.join(directory, "word_counts.tsv"), "w", encoding="utf-8") as f:
+                for word, count in sorted(self.word_counts.items()):
+                    f.write(f"{word}\t{count}\n")
+        meta = dict(self.meta, langs=self.langs, sentences=len(self.ids),
+                    pairs={lang: len(keys) for lang, keys in self.pair_keys.items()},
+                    word_counts=self.word_counts is not None)
+        # meta.json last: an index without it is incomplete and ignored.
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls, directory):
+        """Read an index written by save(); returns None if there is none (or it is incomplete)."""
+        try:
+            with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            count = meta["sentences"]
+            ids = _read_array(os.path.join(directory, "sentences.ids.bin"), 'I', count)
+            lang_numbers = _read_array(os.path.join(directory, "sentences.langs.bin"), 'B', count)
+            hashes = _read_array(os.path.join(directory, "sentences.hashes.bin"), 'Q', count)
+            pair_keys = {lang: _read_array(os.path.join(directory, f"pairs_{lang}.bin"), 'Q', n)
+                         for lang, n in meta["pairs"].items()}
+            word_counts = None
+            if meta["word_counts"]:
+                word_counts = Counter()
+                with open(os.path.join(directory, "word_counts.tsv"), encoding="utf-8") as f:
+                    for line in f:
+                        word, count = line.rstrip("\n").split("\t")
+                        word_counts[word] = int(count)
+        except (OSError, EOFError, KeyError, ValueError):
+            return None
+        return cls(meta["langs"], ids, lang_numbers, hashes, pair_keys, meta, word_counts)
+
+def merge_sorted(old_keys, new_keys):
+    """
+    Walk two sorted sequences of unique keys together. Yields (key, i, j) for every
+    key, where i and j are its positions in old_keys and new_keys (None if absent).
+    """
+    i = j = 0
+    n_old, n_new = len(old_keys), len(new_keys)
+    while i < n_old or j < n_new:
+        if j == n_new or (i < n_old and old_keys[i] < new_keys[j]):
+            yield old_keys[i], i, None
+            i += 1
+        elif i == n_old or new_keys[j] < old_keys[i]:
+            yield new_keys[j], None, j
+            j += 1
+        else:
+            yield old_keys[i], i, j
+            i += 1
+            j += 1
+
+def iter_changes(old, new):
+    """
+    Yield the changes from index old to index new as (change, lang, id, other id)
+    tuples: sentence_added / sentence_removed / sentence_edited (other id is None),
+    then link_added / link_removed for each partner language (the pair's two IDs).
+    Sentences in a language that only one of the indexes covers are not reported.
+    """
+    shared = set(old.langs) & set(new.langs)
+    for sid, i, j in merge_sorted(old.ids, new.ids):
+        if j is None:
+            lang = old.langs[old.lang_numbers[i]]
+            change = "sentence_removed"
+        else:
+            lang = new.langs[new.lang_numbers[j]]
+            if i is None:
+                change = "sentence_added"
+            elif old.hashes[i] != new.hashes[j] or old.langs[old.lang_numbers[i]] != lang:
+                change = "sentence_edited"
+            else:
+                continue
+        if lang in shared:
+            yield change, lang, sid, None
+    for lang, new_keys in new.pair_keys.items():
+        old_keys = old.pair_keys.get(lang)
+        if old_keys is None:
+            continue
+        for key, i, j in merge_sorted(old_keys, new_keys):
+            if i is None or j is None:
+                yield ("link_added" if i is None else "link_removed"), lang, key >> 32, key & 0xFFFFFFFF
+
+def write_report(old, new, output_filename):
+    """Write the changes from old to new as a TSV; returns a Counter of the changes by (change, lang)."""
+    summary = Counter()
+    with open(output_filename, "w", encoding="utf-8") as f_out:
+        f_out.write("change\tlang\tid\tother_id\n")
+        for change, lang, sid, other in iter_changes(old, new):
+            summary[change, lang] += 1
+            f_out.write(f"{change}\t{lang}\t{sid}\t{'' if other is None else other}\n")
+    return summary
+
+def read_fixed_lines(raw_filename, fixed_filename):
+    """
+    Return ({line: fixed line}, Counter of the lines) for the pivot text and fixed
+    text written by a previous run (fixer.fix_file keeps them line for line), or
+    ({}, Counter()) if they are missing.
+    """
+    fixed_by_line, line_counts = {}, Counter()
+    if not (os.path.isfile(raw_filename) and os.path.isfile(fixed_filename)):
+        return fixed_by_line, line_counts
+    with open(raw_filename, encoding="utf-8") as f_raw, open(fixed_filename, encoding="utf-8") as f_fixed:
+        for line, fixed in zip(f_raw, f_fixed):
+            fixed_by_line[line] = fixed
+            line_counts[line] += 1
+    return fixed_by_line, line_counts
+
+def patch_fixed_file(raw_filename, fixed_filename, previous_fixed, mapping, previous_raw_lines=None,
+                     word_counts=None):
+    """
+    Same output as fixer.fix_file(raw_filename, fixed_filename, mapping), but lines
+    found in previous_fixed (the first value of read_fixed_lines, read before the
+    pivot text was rewritten) are reused instead of fixed again.
+
+    If word_counts (the kab_stopwords.count_words of the previous fixed text) and
+    previous_raw_lines (the second value of read_fixed_lines) are given, word_counts
+    is updated in place to the new fixed text, counting only the lines added or
+    removed.
+
+    Returns (number of lines changed by the fix, number of lines fixed again).
+    """
+    num_fixed = recomputed = 0
+    new_raw_lines = Counter()
+    with open(raw_filename, encoding="utf-8") as f_in, open(fixed_filename, "w", encoding="utf-8") as f_out:
+        for line in f_in:
+            fixed = previous_fixed.get(line)
+            if fixed is None:
+                fixed = previous_fixed[line] = fixer.fix_sentence(line, mapping)
+                recomputed += 1
+            if fixed != line:
+                num_fixed += 1
+            new_raw_lines[line] += 1
+            f_out.write(fixed)
+    if word_counts is not None:
+        for line in set(previous_raw_lines) | set(new_raw_lines):
+            difference = new_raw_lines[line] - previous_raw_lines[line]
+            if difference:
+                for word, count in count_words(previous_fixed[line]).items():
+                    word_counts[word] += difference * count
+        for word in [word for word, count in word_counts.items() if count <= 0]:
+            del word_counts[word]
+    return num_fixed, recomputed
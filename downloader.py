@@ -1,32 +1,504 @@
 # downloader.py
+import hashlib
+import io
+import json
 import os
+import threading
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
 import requests
 
+EXPORTS_URL = "https://downloads.tatoeba.org/exports"
+SENTENCES_URL = f"{EXPORTS_URL}/sentences.tar.bz2"
+LINKS_URL = f"{EXPORTS_URL}/links.tar.bz2"
+
+# With at most this many languages, per-language exports are smaller than the full ones.
+PER_LANGUAGE_MAX_LANGS = 4
+
+# Range downloads: the file is fetched in RANGE_SIZE byte ranges into <filename>.part,
+# and the ranges already written are listed in the <filename>.ranges sidecar.
+RANGE_SIZE = 8 << 20
+DOWNLOAD_WORKERS = 4
+PART_SUFFIX = ".part"
+RANGES_SUFFIX = ".ranges"
+STREAM_CHUNK_SIZE = 1 << 16
+
+# Conditional downloads: the validators (ETag, Last-Modified) and SHA-256 of every
+# downloaded file are kept in this manifest, in the directory of the files.
+MANIFEST_NAME = "downloads.json"
+_manifest_lock = threading.Lock()
+PROGRESS_STEP = 1 << 20  # bytes between two progress callbacks
+
+class DownloadCancelled(Exception):
+    """Raised in a download stopped because another download of the same batch failed."""
+
+class DownloadProgress:
+    """
+    Combined progress of concurrent downloads: bytes received out of the total size
+    of the files being downloaded (files found up to date are not counted). The
+    callback, if any, is called with the DownloadProgress about every PROGRESS_STEP
+    bytes and when a file starts. Thread-safe.
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.done = 0
+        self.total = 0
+        self._reported = 0
+        self._lock = threading.Lock()
+
+    def start(self, size, already_done=0):
+        """Count a download of size bytes, already_done of them on disk (resumed ranges)."""
+        with self._lock:
+            self.total += size
+            self.done += already_done
+        self._report(force=True)
+
+    def advance(self, nbytes):
+        with self._lock:
+            self.done += nbytes
+        self._report()
+
+    def _report(self, force=False):
+        if self.callback and (force or self.done - self._reported >= PROGRESS_STEP):
+            self._reported = self.done
+            self.callback(self)
+
+    def __str__(self):
+        percent = f" ({self.done / self.total:.0%})" if self.total else ""
+        return f"{self.done / 2**20:.1f} / {self.total / 2**20:.1f} MiB{percent}"
+
+def per_language_sentences_url(lang):
+    """Return the URL of Tatoeba's per-language sentences export for lang."""
+    return f"{EXPORTS_URL}/per_language/{lang}/{lang}_sentences.tsv.bz2"
+
+def per_language_links_url(lang, other_lang):
+    """Return the URL of Tatoeba's links export between lang and other_lang."""
+    return f"{EXPORTS_URL}/per_language/{lang}/{lang}-{other_lang}_links.tsv.bz2"
+
+def plan_exports(pivot_lang, other_langs, export="auto", download_dir="."):
+    """
+    Decide which Tatoeba exports a run needs.
+    export is "full" (sentences.tar.bz2 + links.tar.bz2), "per_language" (one sentences
+    file per language and one links file per pivot/other pair) or "auto", which picks
+    per-language exports when at most PER_LANGUAGE_MAX_LANGS languages are involved.
+    Returns (sentences, links): sentences maps each language to a (url, filename)
+    pair, links maps each other language to a (url, filename) pair. With full exports
+    every entry points to the same archive.
+    """
+    langs = [pivot_lang] + [lang for lang in other_langs if lang != pivot_lang]
+    if export == "auto":
+        export = "per_language" if len(langs) <= PER_LANGUAGE_MAX_LANGS else "full"
+    if export == "full":
+        sentences = (SENTENCES_URL, os.path.join(download_dir, "sentences.tar.bz2"))
+        links = (LINKS_URL, os.path.join(download_dir, "links.tar.bz2"))
+        return {lang: sentences for lang in langs}, {lang: links for lang in langs[1:]}
+    if export != "per_language":
+        raise ValueError(f"Unknown export kind: {export!r}")
+    def local(url):
+        return url, os.path.join(download_dir, url.rsplit("/", 1)[-1])
+    sentences = {lang: local(per_language_sentences_url(lang)) for lang in langs}
+    links = {lang: local(per_language_links_url(pivot_lang, lang)) for lang in langs[1:]}
+    return sentences, links
+
+class TeeStream(io.RawIOBase):
+    """
+    A file being downloaded, readable while it downloads (tee-streaming): pass it as
+    tee to download_file, and read it from another thread, e.g. as the source of
+    extractor.iter_sentence_batches. Reads return the bytes already written to disk
+    and wait for the rest; they end when the download is complete and raise the
+    download's error if it fails. name is the final filename, so the extractor
+    knows the kind of export. An up-to-date file is read from disk.
+    """
+
+    def __init__(self, filename):
+        super().__init__()
+        self.name = filename
+        self._condition = threading.Condition()
+        self._path = None      # file being written: the part file, then filename
+        self._available = 0    # length of the prefix of _path already written
+        self._complete = False
+        self._error = None
+        self._file = None
+        self._position = 0
+
+    # Download side.
+
+    def _begin(self, path, available=0):
+        with self._condition:
+            self._path, self._available = path, available
+            self._condition.notify_all()
+
+    def _advance(self, available):
+        with self._condition:
+            self._available = max(self._available, available)
+            self._condition.notify_all()
+
+    def _replace(self, path, filename):
+        """Rename the part file path to filename; a reader opening the file afterwards opens filename."""
+        with self._condition:
+            os.replace(path, filename)
+            if self._file is None:
+                self._path = filename
+            self._condition.notify_all()
+
+    def _finish(self, filename):
+        with self._condition:
+            if self._file is None:
+                self._path = filename  # up to date: the file was not downloaded
+            self._available = os.path.getsize(filename)
+            self._complete = True
+            self._condition.notify_all()
+
+    def _fail(self, error):
+        with self._condition:
+            self._error = error
+            self._condition.notify_all()
+
+    # Reader side.
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        with self._condition:
+            while self._error is None and not self._complete \
+                    and (self._path is None or self._available <= self._position):
+                self._condition.wait()
+            if self._error is not None:
+                raise self._error
+            count = min(len(buffer), self._available - self._position)
+            if self._file is None and count > 0:
+                self._file = open(self._path, "rb")
+        if count <= 0:
+            return 0
+        self._file.seek(self._position)
+        count = self._file.readinto(memoryview(buffer)[:count])
+        self._position += count
+        return count
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        super().close()
+
 def get_remote_file_size(url):
     """Return the remote file size (in bytes) using a HEAD request."""
     response = requests.head(url)
     response.raise_for_status()
     return int(response.headers.get('Content-Length', 0))
 
-def download_file(url, filename):
+def has_pending_ranges(filename):
+    """Whether an interrupted range download of filename can be resumed."""
+    return os.path.exists(filename + RANGES_SUFFIX) and os.path.exists(filename + PART_SUFFIX)
+
+def _load_ranges(filename, url, size, range_size, validators):
+    """Return the set of range numbers already written for this download, if the sidecar matches it."""
+    try:
+        with open(filename + RANGES_SUFFIX, encoding="utf-8") as f:
+            state = json.load(f)
+        if (state["url"], state["size"], state["range_size"], state["validators"]) \
+                == (url, size, range_size, validators) \
+                and os.path.getsize(filename + PART_SUFFIX) == size:
+            return set(state["done"])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return set()
+
+def _save_ranges(filename, url, size, range_size, validators, done):
+    tmp_path = f"{filename}{RANGES_SUFFIX}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"url": url, "size": size, "range_size": range_size, "validators": validators,
+                   "done": sorted(done)}, f)
+    os.replace(tmp_path, filename + RANGES_SUFFIX)
+
+def download_ranges(url, filename, size, workers=DOWNLOAD_WORKERS, range_size=RANGE_SIZE, validators=None,
+                    progress=None, cancel=None, tee=None):
     """
-    Download a file from URL to filename if it doesn't exist
-    or its size does not match the remote file size.
+    Download the size bytes of url to filename as byte ranges fetched by a pool of
+    workers threads. The ranges are written in place into <filename>.part, and each
+    finished range is recorded in the <filename>.ranges sidecar, so a download
+    interrupted for any reason resumes with the missing ranges only. The part file
+    is renamed to filename once complete. The server must accept range requests.
+    validators ({"etag": ..., "last_modified": ...} of the remote file) are sent
+    as If-Range, so ranges of a file replaced meanwhile are refused, and a sidecar
+    is only resumed for the same validators.
+    progress (a DownloadProgress) is advanced as bytes arrive. Setting cancel (a
+    threading.Event) stops the download with DownloadCancelled; it is also set
+    when a range fails, to stop the other ranges.
+    With tee (a TeeStream), the ranges are fetched in file order and the tee can
+    read up to the end of the first range not yet finished.
     """
-    remote_size = get_remote_file_size(url)
-    if os.path.exists(filename):
-        local_size = os.path.getsize(filename)
-        if local_size == remote_size:
-            print(f"{filename} already exists (size: {local_size} bytes), skipping download.")
-            return
-        else:
-            print(f"{filename} exists but size differs (local: {local_size}, remote: {remote_size}). Re-downloading.")
+    validators = validators or {}
+    cancel = cancel or threading.Event()
+    part_path = filename + PART_SUFFIX
+    range_headers = {}
+    if validators.get("etag") or validators.get("last_modified"):
+        range_headers["If-Range"] = validators.get("etag") or validators["last_modified"]
+    done = _load_ranges(filename, url, size, range_size, validators)
+    if not done:
+        with open(part_path, "wb") as f:
+            f.truncate(size)
+    todo = [i for i in range((size + range_size - 1) // range_size) if i not in done]
+    if done:
+        print(f"Resuming {filename}: {len(done)} of {len(done) + len(todo)} ranges already downloaded.")
+    if progress:
+        progress.start(size, size - sum(min((i + 1) * range_size, size) - i * range_size for i in todo))
+
+    first_missing = [0]
+
+    def prefix():
+        """Length of the start of the part file whose ranges are all written."""
+        while first_missing[0] in done:
+            first_missing[0] += 1
+        return min(first_missing[0] * range_size, size)
+
+    if tee:
+        tee._begin(part_path, prefix())
+    lock = threading.Lock()
+    local = threading.local()
+
+    def fetch(i):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        start, end = i * range_size, min((i + 1) * range_size, size) - 1
+        headers = dict(range_headers, Range=f"bytes={start}-{end}")
+        with local.session.get(url, headers=headers, stream=True) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise Exception(f"{url} ignored the range request (status {response.status_code}).")
+            written = 0
+            with open(part_path, "r+b") as f:
+                f.seek(start)
+                for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                    if cancel.is_set():
+                        raise DownloadCancelled(f"Download of {filename} cancelled.")
+                    f.write(chunk)
+                    written += len(chunk)
+                    if progress:
+                        progress.advance(len(chunk))
+        if written != end + 1 - start:
+            raise Exception(f"Range {start}-{end} of {url} was cut short ({written} bytes received).")
+        with lock:
+            done.add(i)
+            _save_ranges(filename, url, size, range_size, validators, done)
+            if tee:
+                tee._advance(prefix())
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = [executor.submit(fetch, i) for i in todo]
+        finished, _ = wait(futures, return_when=FIRST_EXCEPTION)
+        if any(future.exception() for future in finished):
+            cancel.set()
+        for future in futures:
+            future.cancel()
+        for future in finished:
+            future.result()  # re-raise the first failure; finished ranges stay in the sidecar
+    _replace_part(part_path, filename, tee)
+    os.remove(filename + RANGES_SUFFIX)
+
+def file_sha256(filename):
+    """Return the hex SHA-256 of a file."""
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def manifest_path(filename):
+    """Return the path of the download manifest covering filename."""
+    return os.path.join(os.path.dirname(filename), MANIFEST_NAME)
+
+def load_manifest(path):
+    """Return the {file name: entry} download manifest at path ({} if missing or unreadable)."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _record_download(filename, url, validators, sha256):
+    """Store the validators, size, mtime and SHA-256 of the downloaded filename in its manifest."""
+    st = os.stat(filename)
+    path = manifest_path(filename)
+    with _manifest_lock:
+        manifest = load_manifest(path)
+        manifest[os.path.basename(filename)] = dict(validators, url=url, size=st.st_size,
+                                                    mtime_ns=st.st_mtime_ns, sha256=sha256)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+
+def _local_entry(url, filename):
+    """
+    Return the manifest entry of filename if the local file is the one it describes:
+    same size and mtime, or else (a copied or touched file) the same SHA-256.
+    """
+    if not os.path.exists(filename):
+        return None
+    entry = load_manifest(manifest_path(filename)).get(os.path.basename(filename))
+    if not entry or entry.get("url") != url:
+        return None
+    st = os.stat(filename)
+    if (st.st_size, st.st_mtime_ns) == (entry.get("size"), entry.get("mtime_ns")):
+        return entry
+    if st.st_size == entry.get("size") and file_sha256(filename) == entry.get("sha256"):
+        _record_download(filename, url, _entry_validators(entry), entry["sha256"])
+        return entry
+    return None
+
+def _validators(headers):
+    """The validators of a response's headers, as stored in the manifest."""
+    return {"etag": headers.get("ETag"), "last_modified": headers.get("Last-Modified")}
+
+def _entry_validators(entry):
+    return {"etag": entry.get("etag"), "last_modified": entry.get("last_modified")}
+
+def _replace_part(part_path, filename, tee=None):
+    """Give the complete part file its final name, through tee if the file is being read."""
+    if tee:
+        tee._replace(part_path, filename)
     else:
-        print(f"Downloading {filename} from {url} ...")
-    response = requests.get(url, stream=True)
-    response.raise_for_status()
-    with open(filename, "wb") as f:
-        for chunk in response.iter_content(chunk_size=8192):
+        os.replace(part_path, filename)
+
+def _stream_to_file(response, filename, progress=None, cancel=None, tee=None):
+    """Write the body of response to filename (through a part file); returns its SHA-256."""
+    digest = hashlib.sha256()
+    if progress:
+        progress.start(int(response.headers.get('Content-Length', 0)))
+    if tee:
+        tee._begin(filename + PART_SUFFIX)
+    written = 0
+    with open(filename + PART_SUFFIX, "wb") as f:
+        for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+            if cancel is not None and cancel.is_set():
+                raise DownloadCancelled(f"Download of {filename} cancelled.")
             if chunk:
                 f.write(chunk)
+                digest.update(chunk)
+                if progress:
+                    progress.advance(len(chunk))
+                if tee:
+                    written += len(chunk)
+                    f.flush()
+                    tee._advance(written)
+    _replace_part(filename + PART_SUFFIX, filename, tee)
+    return digest.hexdigest()
+
+def download_file(url, filename, workers=DOWNLOAD_WORKERS, range_size=RANGE_SIZE, progress=None, cancel=None,
+                  tee=None):
+    """
+    Download a file from URL to filename unless the local copy is up to date.
+    Freshness is decided by a single conditional GET: the ETag and Last-Modified
+    recorded in the download manifest (downloads.json, next to the file) at the
+    previous download are sent as If-None-Match / If-Modified-Since, and an
+    unchanged file costs one 304 response. Servers that ignore these headers are
+    caught by comparing the returned validators with the manifest's. A file
+    without a manifest entry, or whose server sends no validators at all, is kept
+    if its size matches the remote size.
+    If the server accepts range requests, the file is fetched in parallel byte
+    ranges and an interrupted download is resumed (see download_ranges).
+    progress, cancel and tee are as in download_ranges: with tee, the file can be read
+    while it downloads (see TeeStream).
+    Returns True if the file was downloaded, False if it was up to date.
+    """
+    try:
+        downloaded = _download_file(url, filename, workers, range_size, progress, cancel, tee)
+    except BaseException as error:
+        if tee:
+            tee._fail(error)
+        raise
+    if tee:
+        tee._finish(filename)
+    return downloaded
+
+def _download_file(url, filename, workers, range_size, progress, cancel, tee):
+    entry = _local_entry(url, filename)
+    headers = {}
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    with requests.get(url, headers=headers, stream=True) as response:
+        if response.status_code == 304:
+            print(f"{filename} is up to date (not modified), skipping download.")
+            return False
+        response.raise_for_status()
+        remote_size = int(response.headers.get('Content-Length', 0))
+        validators = _validators(response.headers)
+        accepts_ranges = response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+        if not has_pending_ranges(filename) and os.path.exists(filename):
+            local_size = os.path.getsize(filename)
+            if entry and any(validators.values()) and validators == _entry_validators(entry):
+                print(f"{filename} is up to date (same validators), skipping download.")
+                return False
+            if entry and not any(validators.values()) and not any(_entry_validators(entry).values()) \
+                    and local_size == remote_size:
+                # Without validators on either side, the size is all there is to compare.
+                print(f"{filename} already exists (size: {local_size} bytes, no validators), skipping download.")
+                return False
+            if entry is None and local_size == remote_size:
+                print(f"{filename} already exists (size: {local_size} bytes), skipping download.")
+                _record_download(filename, url, validators, file_sha256(filename))
+                return False
+            print(f"{filename} has changed on the server (local size: {local_size}, remote: {remote_size}). "
+                  f"Re-downloading.")
+        else:
+            print(f"Downloading {filename} from {url} ...")
+        if accepts_ranges and remote_size:
+            response.close()
+            download_ranges(url, filename, remote_size, workers, range_size, validators, progress, cancel, tee)
+            sha256 = file_sha256(filename)
+        else:
+            sha256 = _stream_to_file(response, filename, progress, cancel, tee)
+    _record_download(filename, url, validators, sha256)
     print(f"Downloaded {filename}.")
+    return True
+
+def download_all(downloads, workers=DOWNLOAD_WORKERS, progress=None, tees=None, cancel=None):
+    """
+    Download every {url: filename} of downloads at the same time, one thread per
+    file (each file itself fetched by workers range threads, see download_file),
+    with their combined progress reported to progress. If any download fails, the
+    others are stopped and the first error is raised; their finished ranges are
+    kept for the next attempt. tees optionally maps filenames to the TeeStream
+    through which each file is read while it downloads (see stream_downloads).
+    Setting cancel (a threading.Event) stops all the downloads with DownloadCancelled.
+    Returns {filename: True if downloaded, False if up to date}.
+    """
+    cancel = cancel or threading.Event()
+    tees = tees or {}
+    with ThreadPoolExecutor(max_workers=max(1, len(downloads))) as executor:
+        futures = {executor.submit(download_file, url, filename, workers, progress=progress, cancel=cancel,
+                                   tee=tees.get(filename)): filename
+                   for url, filename in downloads.items()}
+        finished, _ = wait(futures, return_when=FIRST_EXCEPTION)
+        errors = [future.exception() for future in finished if future.exception()]
+        if errors:
+            cancel.set()
+            # The failure itself, rather than a download it cancelled.
+            errors.sort(key=lambda error: isinstance(error, DownloadCancelled))
+            raise errors[0]
+    return {filename: future.result() for future, filename in futures.items()}
+
+def stream_downloads(downloads, workers=DOWNLOAD_WORKERS, progress=None, cancel=None):
+    """
+    Start download_all(downloads) in a background thread and return
+    ({filename: TeeStream}, future): each file can be parsed through its TeeStream
+    while it downloads, and future.result() waits for the downloads (raising their
+    error). A failed download also makes the reads of every TeeStream fail. Set
+    cancel (a threading.Event) if the parsing fails, to stop the downloads.
+    """
+    tees = {filename: TeeStream(filename) for filename in downloads.values()}
+    executor = ThreadPoolExecutor(max_workers=1)
+    future = executor.submit(download_all, downloads, workers, progress, tees, cancel)
+
+    def fail_all(future):
+        error = future.exception()
+        for tee in tees.values():
+            if error is not None:
+                tee._fail(error)
+    future.add_done_callback(fail_all)
+    executor.shutdown(wait=False)
+    return tees, future
@@ -0,0 +1,224 @@
+# external_join.py
+"""
+External-Memory Pair Extraction
+
+planner.extract_pivot_pairs keeps the texts of every requested language in
+memory, which does not fit for large pairs such as eng–fra. This module produces
+the same TSVs with memory capped by memory_limit, by spilling sorted runs to
+temporary files and joining them with k-way merges:
+
+1. The sentence scan writes (id, lang, text) runs sorted by ID and fills one
+   IdBitmap per language (one bit per sentence ID).
+2. The links scan keeps the links matching the bitmaps as
+   (partner, pair key, link number, partner ID, pivot ID) runs.
+3. Merging those runs drops duplicate pairs; the pairs are then sorted by partner
+   ID and merge-joined with the sentence runs for the partner text, sorted by
+   pivot ID and joined again for the pivot text, and finally sorted back into
+   link order and written out.
+
+Each sort keeps at most memory_limit bytes (estimated) of records before
+spilling a run; the merges read every run through a small buffer.
+"""
+
+import contextlib
+import heapq
+import marshal
+import os
+import re
+import tempfile
+
+from extractor import is_tar_path, iter_link_batches
+from id_sets import IdBitmap, UnionFind, pair_key
+from pair_output import open_pair_writer
+from shards import iter_sentences_by_lang
+
+SIZE_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+RUN_BUFFER_SIZE = 1 << 16
+MERGE_FAN_IN = 64  # most runs merged at once (one open file each)
+
+def parse_size(text):
+    """Parse a memory size such as "512M", "2G" or "1048576" (bytes) into a number of bytes."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", str(text), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid memory size: {text!r}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+def _record_size(record):
+    """Rough in-memory size of a tuple of ints and strs, in bytes."""
+    return 56 + sum(49 + len(field) if isinstance(field, str) else 36 for field in record)
+
+class ExternalSorter:
+    """
+    Sorts tuples that do not fit in memory: add() buffers them until memory_limit
+    bytes (estimated) are held, then writes the buffer sorted to a run file in
+    directory. After finish(), iterating yields all tuples in sorted order by
+    merging the runs; it can be repeated.
+    """
+
+    def __init__(self, directory, memory_limit):
+        self.directory = directory
+        self.memory_limit = memory_limit
+        self.runs = []
+        self._buffer = []
+        self._bytes = 0
+
+    def add(self, record):
+        self._buffer.append(record)
+        self._bytes += _record_size(record)
+        if self._bytes >= self.memory_limit:
+            self._spill()
+
+    def _write_run(self, records):
+        fd, path = tempfile.mkstemp(suffix=".run", dir=self.directory)
+        with os.fdopen(fd, "wb", RUN_BUFFER_SIZE) as f:
+            for record in records:
+                marshal.dump(record, f)
+        return path
+
+    def _spill(self):
+        self._buffer.sort()
+        self.runs.append(self._write_run(self._buffer))
+        self._buffer = []
+        self._bytes = 0
+
+    def finish(self):
+        """
+        Spill the remaining records (the sorter then holds no records in memory)
+        and merge runs until at most MERGE_FAN_IN are left.
+        """
+        if self._buffer or not self.runs:
+            self._spill()
+        while len(self.runs) > MERGE_FAN_IN:
+            group, self.runs = self.runs[:MERGE_FAN_IN], self.runs[MERGE_FAN_IN:]
+            self.runs.append(self._write_run(heapq.merge(*[_iter_run(path) for path in group])))
+            for path in group:
+                os.remove(path)
+        return self
+
+    def __iter__(self):
+        return heapq.merge(*[_iter_run(path) for path in self.runs])
+
+def _iter_run(path):
+    with open(path, "rb", RUN_BUFFER_SIZE) as f:
+        while True:
+            try:
+                yield marshal.load(f)
+            except EOFError:
+                return
+
+def join_texts(records, sentences):
+    """
+    Merge-join records sorted by their first field (a sentence ID) with sentences
+    sorted by ID. Yields (record, text) for every record whose sentence exists.
+    """
+    sentences = iter(sentences)
+    current = next(sentences, None)
+    for record in records:
+        while current is not None and current[0] < record[0]:
+            current = next(sentences, None)
+        if current is None:
+            return
+        if current[0] == record[0]:
+            yield record, current[2]
+
+def extract_pivot_pairs(sentence_sources, link_sources, pivot_lang, partner_langs, output_filenames,
+                        headers=None, workers=1, memory_limit=1 << 30, tmp_dir=None, output_format="tsv",
+                        shards=1, compression=None, splits=None, dedup=False):
+    """
+    Same as planner.extract_pivot_pairs (same arguments, same TSVs, same number of
+    scans over the inputs, which it returns), holding at most about memory_limit
+    bytes of sentences or pairs in memory. Sorted runs go to a temporary directory
+    inside tmp_dir (the system default if None), removed at the end.
+    With splits, the pair clusters are tracked during the links scan by one
+    union-find per partner (4 bytes per sentence ID) to route the pairs.
+    With dedup, the 64-bit hashes of the written pairs' normalized texts are kept in
+    memory (12 to 24 bytes per pair) to drop text duplicates.
+    """
+    partner_langs = list(partner_langs)
+    langs = [pivot_lang] + partner_langs
+    with tempfile.TemporaryDirectory(prefix="pairs-", dir=tmp_dir) as directory:
+        # 1. Sentences: runs sorted by ID, and one ID bitmap per language.
+        ids = {lang: IdBitmap() for lang in langs}
+        counts = dict.fromkeys(langs, 0)
+        sentences = ExternalSorter(directory, memory_limit)
+        by_source = {}
+        for lang in langs:
+            by_source.setdefault(sentence_sources[lang], []).append(lang)
+        for source, source_langs in by_source.items():
+            for sid, lang, text in iter_sentences_by_lang(source, source_langs, workers=workers):
+                sid = int(sid)
+                ids[lang].add(sid)
+                counts[lang] += 1
+                sentences.add((sid, lang, text))
+        sentences.finish()
+        passes = len(by_source)
+        for lang in langs:
+            print(f"Found {counts[lang]} sentences in '{lang}'.")
+
+        # 2. Links: matching pairs, keyed by partner and unordered pair.
+        pairs = ExternalSorter(directory, memory_limit)
+        by_source = {}
+        for lang in partner_langs:
+            by_source.setdefault(link_sources[lang], []).append(lang)
+        seq = 0
+        pivot_ids = ids[pivot_lang]
+        union_finds = {lang: UnionFind() for lang in partner_langs} if splits else None
+        for source, source_langs in by_source.items():
+            partners = [(lang, ids[lang]) for lang in source_langs]
+            # A per-pair links export is written in (lower ID, higher ID) order,
+            # the order the full archive yields its pairs in.
+            in_key_order = not is_tar_path(source)
+            for batch in iter_link_batches(source, workers=workers, as_int=True):
+                for sid1, sid2 in batch:
+                    if sid1 in pivot_ids:
+                        pivot, other = sid1, sid2
+                    elif sid2 in pivot_ids:
+                        pivot, other = sid2, sid1
+                    else:
+                        continue
+                    for lang, lang_ids in partners:
+                        if other in lang_ids:
+                            key = pair_key(sid1, sid2)
+                            seq += 1
+                            pairs.add((lang, key, key if in_key_order else seq, other, pivot))
+                            if union_finds:
+                                union_finds[lang].union(other, pivot)
+                            break
+        pairs.finish()
+        passes += len(by_source)
+
+        # 3. Deduplicate, then join the partner texts, then the pivot texts.
+        by_other = ExternalSorter(directory, memory_limit)
+        matched = dict.fromkeys(partner_langs, 0)
+        previous = None
+        for lang, key, order, other, pivot in pairs:
+            if (lang, key) == previous:
+                continue
+            previous = (lang, key)
+            matched[lang] += 1
+            by_other.add((other, order, lang, pivot))
+        by_other.finish()
+        for lang in partner_langs:
+            print(f"Matched {matched[lang]} sentence pairs for '{lang}'.")
+
+        by_pivot = ExternalSorter(directory, memory_limit)
+        for (other, order, lang, pivot), text in join_texts(by_other, sentences):
+            by_pivot.add((pivot, order, lang, other, text))
+        by_pivot.finish()
+
+        by_order = ExternalSorter(directory, memory_limit)
+        for (pivot, order, lang, other, other_text), pivot_text in join_texts(by_pivot, sentences):
+            by_order.add((lang, order, other, other_text, pivot, pivot_text))
+        by_order.finish()
+
+        with contextlib.ExitStack() as stack:
+            writers = {lang: stack.enter_context(open_pair_writer(
+                           output_filenames[lang], (headers or {}).get(lang, ("LangA", "LangB")), output_format,
+                           shards=shards, compression=compression, splits=splits, dedup=dedup))
+                       for lang in partner_langs}
+            for lang, order, other, other_text, pivot, pivot_text in by_order:
+                writers[lang].write(other, other_text, pivot, pivot_text,
+                                    union_finds[lang].find(other) if union_finds else None)
+        for lang in partner_langs:
+            print(f"Wrote sentence pairs to {output_filenames[lang]}.")
+    return passes
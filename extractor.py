@@ -1,49 +1,376 @@
 # extractor.py
+import bz2
+import io
+import os
+import struct
+import sys
 import tarfile
+from contextlib import contextmanager
+from parallel_bz2 import open_parallel
 
-def iter_sentences(tar_filename):
+# Parsed rows of an archive are cached next to it in a compact binary file,
+# so each export is only bz2-decoded once.
+CACHE_SUFFIX = ".cache"
+CACHE_MAGIC = b"KABNLPC1"
+CACHE_HEADER = struct.Struct("<8scqq")  # magic, kind, archive size, archive mtime_ns
+SENTENCE_ROW = struct.Struct("<IBI")    # sentence_id, len(lang), len(text), then the bytes
+LINK_ROW = struct.Struct("<II")         # sentence_id, translation_id
+
+# Pass as the archive to read a tar stream from standard input.
+STDIN = "-"
+
+# Bytes read from an archive member per batch of parsed rows.
+BLOCK_SIZE = 1 << 22
+
+def cache_path(tar_filename, cache_dir=None):
     """
-    Generator that yields (sentence_id, lang, text) for each line in the sentences file.
-    It opens the tar archive, finds the file whose basename starts with "sentences",
-    and streams through its lines.
+    Return the path of the row cache for tar_filename.
+    By default the cache lives next to the archive.
+    """
+    name = os.path.basename(tar_filename) + CACHE_SUFFIX
+    if cache_dir is None:
+        return os.path.join(os.path.dirname(os.path.abspath(tar_filename)), name)
+    return os.path.join(cache_dir, name)
+
+def archive_key(tar_filename):
+    """Return the (size, mtime_ns) pair identifying the current version of an archive."""
+    st = os.stat(tar_filename)
+    return st.st_size, st.st_mtime_ns
+
+def _is_member(name, prefix):
+    # In case the file is inside a folder, check the basename
+    return name.split("/")[-1].startswith(prefix)
+
+def is_archive_path(tar_source):
+    """True if tar_source names an archive on disk (as opposed to STDIN or an open file object)."""
+    return isinstance(tar_source, (str, os.PathLike)) and tar_source != STDIN
+
+def is_tar_path(path):
+    """
+    True if path names a tar archive (sentences.tar.bz2, links.tar.bz2), False for a
+    bare, optionally bz2-compressed TSV file such as Tatoeba's per-language exports
+    (kab_sentences.tsv.bz2, kab-eng_links.tsv.bz2). A file object is judged by its name.
+    """
+    return ".tar" in os.path.basename(os.fspath(getattr(path, "name", path)))
+
+def _extract_first_match(tar, prefix, label):
+    """Read tar as a stream and return a file object for the first member matching prefix."""
+    for m in tar:
+        if _is_member(m.name, prefix):
+            f = tar.extractfile(m)
+            if f is None:
+                raise Exception(f"Could not extract the {label} file.")
+            return f
+    raise Exception(f"Could not find the {label} file in the archive.")
+
+@contextmanager
+def _open_tar_stream(fileobj):
+    """
+    Open the binary file object fileobj as a forward-only tar stream of any
+    compression ("r|*"). bz2 input is decoded by bz2.open instead of tarfile, which
+    stops at the end of the first stream of a multi-stream file (pbzip2, lbzip2).
     """
-    with tarfile.open(tar_filename, "r:bz2") as tar:
+    buffered = fileobj if hasattr(fileobj, "peek") else io.BufferedReader(fileobj)
+    try:
+        if buffered.peek(3)[:3] == b"BZh":
+            with bz2.open(buffered, "rb") as decoded, tarfile.open(fileobj=decoded, mode="r|") as tar:
+                yield tar
+        else:
+            with tarfile.open(fileobj=buffered, mode="r|*") as tar:
+                yield tar
+    finally:
+        if buffered is not fileobj:
+            buffered.detach()  # fileobj is the caller's to close
+
+@contextmanager
+def open_member(tar_source, prefix, label, workers=1, stream=True):
+    """
+    Open the tar archive and return (as a context manager) a binary file object for
+    the file whose basename starts with prefix.
+    tar_source is a path, STDIN ("-") or a binary file object; the last two are read
+    as a forward-only stream of any compression ("r|*"), e.g. piped from another process.
+    A file object whose name is that of a bare export (e.g. a downloader.TeeStream of
+    kab_sentences.tsv.bz2) is read as that file, bz2-decoded if its name ends with ".bz2".
+    A path that is not a tar archive (see is_tar_path) is opened directly as the
+    file, decompressing it if its name ends with ".bz2".
+    By default an archive on disk is also read as a stream (bz2.open, then "r|", so
+    that every stream of a multi-stream bz2 file is read): the member list is never
+    built and reading stops at the first matching member. stream=False restores the
+    random-access getmembers() lookup.
+    With workers > 1 the archive is bz2-decoded block by block in a process pool
+    (see parallel_bz2) and read as a stream as well.
+    """
+    if not is_archive_path(tar_source):
+        fileobj = sys.stdin.buffer if tar_source == STDIN else tar_source
+        name = getattr(fileobj, "name", None)
+        if tar_source != STDIN and isinstance(name, str) and not is_tar_path(name):
+            if name.endswith(".bz2"):
+                with bz2.open(fileobj, "rb") as f:
+                    yield f
+            else:
+                yield fileobj
+            return
+        with _open_tar_stream(fileobj) as tar:
+            yield _extract_first_match(tar, prefix, label)
+        return
+    if not is_tar_path(tar_source):
+        if not os.fspath(tar_source).endswith(".bz2"):
+            with open(tar_source, "rb") as f:
+                yield f
+        elif workers is None or workers > 1:
+            with open_parallel(tar_source, workers) as f:
+                yield f
+        else:
+            with bz2.open(tar_source, "rb") as f:
+                yield f
+        return
+    if workers is None or workers > 1:
+        with open_parallel(tar_source, workers) as decoded, \
+             tarfile.open(fileobj=decoded, mode="r|") as tar:
+            yield _extract_first_match(tar, prefix, label)
+        return
+    if stream:
+        with bz2.open(tar_source, "rb") as decoded, tarfile.open(fileobj=decoded, mode="r|") as tar:
+            yield _extract_first_match(tar, prefix, label)
+        return
+    with tarfile.open(tar_source, "r:bz2") as tar:
         member = None
         for m in tar.getmembers():
-            # In case the file is inside a folder, check the basename
-            if m.name.split("/")[-1].startswith("sentences"):
+            if _is_member(m.name, prefix):
                 member = m
                 break
         if member is None:
-            raise Exception("Could not find the sentences file in the archive.")
+            raise Exception(f"Could not find the {label} file in the archive.")
         f = tar.extractfile(member)
         if f is None:
-            raise Exception("Could not extract the sentences file.")
-        for line in f:
-            parts = line.decode('utf-8').rstrip("\n").split("\t")
-            if len(parts) < 3:
-                continue
-            yield parts[0], parts[1], parts[2]
+            raise Exception(f"Could not extract the {label} file.")
+        yield f
 
-def iter_links(tar_filename):
+def iter_member_blocks(tar_source, prefix, label, workers=1, stream=True, block_size=BLOCK_SIZE):
     """
-    Generator that yields (sentence_id, translation_id) for each line in the links file.
-    It opens the tar archive, finds the file whose basename starts with "links",
-    and streams through its lines.
+    Read the member opened by open_member in blocks of block_size bytes and yield,
+    for each block, the list of its complete lines (without newline). A partial
+    last line is carried over to the next block.
     """
-    with tarfile.open(tar_filename, "r:bz2") as tar:
-        member = None
-        for m in tar.getmembers():
-            if m.name.split("/")[-1].startswith("links"):
-                member = m
+    with open_member(tar_source, prefix, label, workers, stream) as f:
+        tail = b""
+        while True:
+            block = f.read(block_size)
+            if not block:
                 break
-        if member is None:
-            raise Exception("Could not find the links file in the archive.")
-        f = tar.extractfile(member)
-        if f is None:
-            raise Exception("Could not extract the links file.")
-        for line in f:
-            parts = line.decode('utf-8').rstrip("\n").split("\t")
-            if len(parts) < 2:
-                continue
-            yield parts[0], parts[1]
+            lines = (tail + block if tail else block).split(b"\n")
+            tail = lines.pop()
+            yield lines
+        if tail:
+            yield [tail]
+
+def _split_sentence_lines(lines):
+    """Return (sentence_id, lang, text) as undecoded bytes for each well-formed line."""
+    return [parts[:3] for parts in [line.split(b"\t") for line in lines] if len(parts) >= 3]
+
+def _split_link_lines(lines):
+    """Return (sentence_id, translation_id) as undecoded bytes for each well-formed line."""
+    return [parts[:2] for parts in [line.split(b"\t") for line in lines] if len(parts) >= 2]
+
+def _sentence_decoder(langs):
+    """
+    Return a function decoding a batch of raw sentence rows, keeping only the rows
+    whose lang field is in langs; only those pay for the UTF-8 decode.
+    """
+    if langs is None:
+        return lambda rows: [(sid.decode('utf-8'), lang.decode('utf-8'), text.decode('utf-8'))
+                             for sid, lang, text in rows]
+    wanted = _lang_bytes(langs)
+    return lambda rows: [(sid.decode('utf-8'), lang.decode('utf-8'), text.decode('utf-8'))
+                         for sid, lang, text in rows if lang in wanted]
+
+def _decode_links(rows):
+    return [(sid1.decode('utf-8'), sid2.decode('utf-8')) for sid1, sid2 in rows]
+
+def _int_links(rows):
+    return [(int(sid1), int(sid2)) for sid1, sid2 in rows]
+
+def _lang_bytes(langs):
+    if isinstance(langs, str):
+        langs = [langs]
+    return {lang.encode('utf-8') for lang in langs}
+
+def _encode_sentences(rows):
+    pack = SENTENCE_ROW.pack
+    return b"".join([pack(int(sid), len(lang), len(text)) + lang + text for sid, lang, text in rows])
+
+def _encode_links(rows):
+    pack = LINK_ROW.pack
+    return b"".join([pack(int(sid1), int(sid2)) for sid1, sid2 in rows])
+
+def _read_cache_blocks(f, block_size=1 << 22):
+    """Yield buffers of cache bytes; the caller sends back how many bytes it consumed and the rest is carried into the next read."""
+    buf = b""
+    while True:
+        chunk = f.read(block_size)
+        if not chunk:
+            if buf:
+                raise Exception("Truncated cache file.")
+            return
+        buf = buf + chunk if buf else chunk
+        consumed = yield buf
+        buf = buf[consumed:]
+
+def _iter_cached_sentences(f, langs=None):
+    wanted = _lang_bytes(langs) if langs is not None else None
+    head_size = SENTENCE_ROW.size
+    unpack_from = SENTENCE_ROW.unpack_from
+    blocks = _read_cache_blocks(f)
+    try:
+        buf = next(blocks)
+        while True:
+            pos = 0
+            end = len(buf)
+            batch = []
+            while pos + head_size <= end:
+                sid, lang_len, text_len = unpack_from(buf, pos)
+                stop = pos + head_size + lang_len + text_len
+                if stop > end:
+                    break
+                start = pos + head_size
+                pos = stop
+                if wanted is not None and buf[start:start + lang_len] not in wanted:
+                    continue
+                batch.append((str(sid),
+                              buf[start:start + lang_len].decode('utf-8'),
+                              buf[start + lang_len:stop].decode('utf-8')))
+            yield batch
+            buf = blocks.send(pos)
+    except StopIteration:
+        return
+
+def _iter_cached_links(f, as_int=False):
+    row_size = LINK_ROW.size
+    blocks = _read_cache_blocks(f)
+    try:
+        buf = next(blocks)
+        while True:
+            usable = len(buf) - len(buf) % row_size
+            rows = LINK_ROW.iter_unpack(memoryview(buf)[:usable])
+            if as_int:
+                yield list(rows)
+            else:
+                yield [(str(sid1), str(sid2)) for sid1, sid2 in rows]
+            buf = blocks.send(usable)
+    except StopIteration:
+        return
+
+def _open_valid_cache(path, kind, key):
+    """Return the cache file positioned after its header, or None if it is missing or stale."""
+    try:
+        f = open(path, "rb")
+    except OSError:
+        return None
+    header = f.read(CACHE_HEADER.size)
+    if len(header) == CACHE_HEADER.size:
+        magic, cached_kind, size, mtime_ns = CACHE_HEADER.unpack(header)
+        if magic == CACHE_MAGIC and cached_kind == kind and (size, mtime_ns) == key:
+            return f
+    f.close()
+    return None
+
+def _iter_with_cache(tar_filename, kind, raw_batches, encode, decode, read_cached, use_cache, cache_dir):
+    """
+    Serve row batches from the cache when it matches the archive; otherwise stream
+    the raw batches from the archive, write the cache as a side effect of a complete
+    pass, and yield decode(batch) for each of them.
+    """
+    if not use_cache or not is_archive_path(tar_filename):
+        for batch in raw_batches():
+            yield decode(batch)
+        return
+    path = cache_path(tar_filename, cache_dir)
+    key = archive_key(tar_filename)
+    f = _open_valid_cache(path, kind, key)
+    if f is not None:
+        with f:
+            yield from read_cached(f)
+        return
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        out = open(tmp_path, "wb")
+    except OSError:
+        for batch in raw_batches():
+            yield decode(batch)
+        return
+    completed = False
+    try:
+        out.write(CACHE_HEADER.pack(CACHE_MAGIC, kind, *key))
+        for batch in raw_batches():
+            if out is not None:
+                try:
+                    out.write(encode(batch))
+                except (ValueError, struct.error):
+                    # A row does not fit the binary layout: give up on caching, keep streaming.
+                    out.close()
+                    out = None
+            yield decode(batch)
+        completed = out is not None
+    finally:
+        if out is not None:
+            out.close()
+        if completed:
+            os.replace(tmp_path, path)
+        elif os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def iter_sentence_batches(tar_filename, use_cache=True, cache_dir=None, workers=1, langs=None, stream=True,
+                          block_size=BLOCK_SIZE):
+    """
+    Generator that yields lists of (sentence_id, lang, text) rows from the sentences file,
+    one list per block of block_size bytes read from the archive (or from the cache).
+    It opens the tar archive, finds the file whose basename starts with "sentences",
+    and streams through it; tar_filename may also be a per-language sentences export.
+    The first complete pass over an archive writes a binary row cache (see cache_path);
+    later passes read that cache instead of decompressing the archive again.
+    workers > 1 (or None for one per CPU) decodes the bz2 blocks in parallel.
+    If langs (a language code or a collection of them) is given, only sentences in
+    those languages are kept: the lang field is tested on the raw bytes and only
+    matching lines are decoded.
+    tar_filename may also be STDIN or a file object, read in a single streaming pass
+    without the cache; see open_member for the stream option.
+    """
+    return _iter_with_cache(
+        tar_filename, b"S",
+        lambda: map(_split_sentence_lines,
+                    iter_member_blocks(tar_filename, "sentences", "sentences", workers, stream, block_size)),
+        _encode_sentences, _sentence_decoder(langs),
+        lambda f: _iter_cached_sentences(f, langs), use_cache, cache_dir)
+
+def iter_link_batches(tar_filename, use_cache=True, cache_dir=None, workers=1, stream=True,
+                      block_size=BLOCK_SIZE, as_int=False):
+    """
+    Generator that yields lists of (sentence_id, translation_id) rows from the links file,
+    one list per block. It opens the tar archive, finds the file whose basename starts
+    with "links", and streams through it; tar_filename may also be a per-pair links export.
+    With as_int=True the IDs are ints rather than str (no string is built from the cache).
+    Uses the same binary row cache, sources and options as iter_sentence_batches.
+    """
+    return _iter_with_cache(
+        tar_filename, b"L",
+        lambda: map(_split_link_lines,
+                    iter_member_blocks(tar_filename, "links", "links", workers, stream, block_size)),
+        _encode_links, _int_links if as_int else _decode_links,
+        lambda f: _iter_cached_links(f, as_int), use_cache, cache_dir)
+
+def iter_sentences(tar_filename, use_cache=True, cache_dir=None, workers=1, langs=None, stream=True):
+    """
+    Generator that yields (sentence_id, lang, text) for each line in the sentences file.
+    Thin wrapper over iter_sentence_batches, which documents the options.
+    """
+    for batch in iter_sentence_batches(tar_filename, use_cache, cache_dir, workers, langs, stream):
+        yield from batch
+
+def iter_links(tar_filename, use_cache=True, cache_dir=None, workers=1, stream=True):
+    """
+    Generator that yields (sentence_id, translation_id) for each line in the links file.
+    Thin wrapper over iter_link_batches, which documents the options.
+    """
+    for batch in iter_link_batches(tar_filename, use_cache, cache_dir, workers, stream):
+        yield from batch
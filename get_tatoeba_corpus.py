@@ -5,6 +5,8 @@ Tatoeba Corpus Processing Tool
 Ce script télécharge les archives Tatoeba (phrases et liens), 
 extrait les paires de phrases anglais–kabyle et les enregistre dans un fichier TSV,
 puis crée deux fichiers texte (eng.txt et kab.txt) pour les phrases respectives.
+Plusieurs langues sources (--source_lang eng fra ...) sont appariées avec la langue
+cible en un seul parcours des phrases et un seul parcours des liens (un TSV par langue).
 Ensuite, il corrige le fichier kab.txt via le module fixer,
 et enfin, il génère une liste de stopwords en kabyle à partir du fichier corrigé.
 Tous les fichiers de sortie sont sauvegardés dans le répertoire "corpus" (défaut).
@@ -15,13 +17,18 @@ Tatoeba exports: https://tatoeba.org/en/downloads
 import os
 import re
 import unicodedata
-import requests
-import tarfile
-import csv
 import argparse
+import threading
 from yaspin import yaspin
 import fixer  # Module de correction
 import kab_stopwords  # Notre module pour créer la liste de stopwords
+import downloader  # Choix des exports Tatoeba (complets ou par langue)
+import planner  # Extraction des paires en deux passes
+import external_join  # Même extraction, avec mémoire bornée (tris externes sur disque)
+import clusters  # Groupes de traductions (union-find sur les paires)
+import pair_output  # Sortie des paires en TSV, Parquet ou Arrow
+import delta  # Mise à jour incrémentale entre deux instantanés Tatoeba
+from extractor import archive_key
 import nltk
 
 # Téléchargement des ressources NLTK
@@ -35,134 +42,49 @@ LINKS_URL = "https://downloads.tatoeba.org/exports/links.tar.bz2"
 SENTENCES_TAR = "sentences.tar.bz2"
 LINKS_TAR = "links.tar.bz2"
 
-### Fonctions de téléchargement ###
-def get_remote_file_size(url):
-    response = requests.head(url)
-    response.raise_for_status()
-    return int(response.headers.get('Content-Length', 0))
+# Noms des colonnes du TSV des paires (code ISO par défaut pour les autres langues)
+LANGUAGE_NAMES = {"eng": "English", "kab": "Kabyle", "fra": "French", "deu": "German",
+                  "spa": "Spanish", "ara": "Arabic", "ber": "Berber"}
 
-def download_file(url, filename):
-    remote_size = get_remote_file_size(url)
-    if os.path.exists(filename):
-        local_size = os.path.getsize(filename)
-        if local_size == remote_size:
-            print(f"{filename} existe déjà (taille {local_size} octets), téléchargement ignoré.")
-            return
-        else:
-            print(f"{filename} existe mais la taille diffère (local: {local_size}, remote: {remote_size}). Re-téléchargement.")
-    else:
-        print(f"Téléchargement de {filename} depuis {url} ...")
-    response = requests.get(url, stream=True)
-    response.raise_for_status()
-    with open(filename, "wb") as f:
-        for chunk in response.iter_content(chunk_size=8192):
-            if chunk:
-                f.write(chunk)
-    print(f"Téléchargement terminé pour {filename}.")
-
-### Fonctions génératrices pour parcourir les archives ###
-def iter_sentences(tar_filename):
-    with tarfile.open(tar_filename, "r:bz2") as tar:
-        member = None
-        for m in tar.getmembers():
-            if os.path.basename(m.name).startswith("sentences"):
-                member = m
-                break
-        if member is None:
-            raise Exception("Fichier 'sentences' introuvable dans l'archive.")
-        f = tar.extractfile(member)
-        if f is None:
-            raise Exception("Impossible d'extraire le fichier 'sentences'.")
-        for line in f:
-            parts = line.decode('utf-8').rstrip("\n").split("\t")
-            if len(parts) < 3:
-                continue
-            yield parts[0], parts[1], parts[2]
-
-def iter_links(tar_filename):
-    with tarfile.open(tar_filename, "r:bz2") as tar:
-        member = None
-        for m in tar.getmembers():
-            if os.path.basename(m.name).startswith("links"):
-                member = m
-                break
-        if member is None:
-            raise Exception("Fichier 'links' introuvable dans l'archive.")
-        f = tar.extractfile(member)
-        if f is None:
-            raise Exception("Impossible d'extraire le fichier 'links'.")
-        for line in f:
-            parts = line.decode('utf-8').rstrip("\n").split("\t")
-            if len(parts) < 2:
-                continue
-            yield parts[0], parts[1]
+# Corrections appliquées à kab.txt par le module fixer
+FIX_MAPPING = {
+    'ţţ': 'tt',
+    'țț': 'tt',
+    'ε': 'ɛ',
+    'ϵ': 'ɛ',
+    'γ': 'ɣ',
+    'Γ': 'Ɣ',
+    'Σ': 'Ɛ',
+    'Ԑ': 'Ɛ',
+    'ğ': 'ǧ',
+    'ş': 'ṣ'
+}
 
 ### Fonctions de traitement ###
-def build_kab_sentence_dict():
-    kab_sentences = {}
-    for sid, lang, text in iter_sentences(SENTENCES_TAR):
-        if lang == "kab":
-            kab_sentences[sid] = text
-    print(f"Trouvé {len(kab_sentences)} phrases en kabyle.")
-    return kab_sentences
-
-def build_eng_ids_needed(kab_sentences):
-    eng_ids = set()
-    for sid1, sid2 in iter_links(LINKS_TAR):
-        if sid1 in kab_sentences and sid2 not in kab_sentences:
-            eng_ids.add(sid2)
-        elif sid2 in kab_sentences and sid1 not in kab_sentences:
-            eng_ids.add(sid1)
-    print(f"Identifié {len(eng_ids)} IDs de phrases anglaises associées au kabyle.")
-    return eng_ids
-
-def build_eng_sentence_dict(eng_ids):
-    eng_sentences = {}
-    for sid, lang, text in iter_sentences(SENTENCES_TAR):
-        if lang == "eng" and sid in eng_ids:
-            eng_sentences[sid] = text
-    print(f"Chargé {len(eng_sentences)} phrases anglaises parmi les IDs candidats.")
-    return eng_sentences
-
-def write_sentence_pairs(eng_sentences, kab_sentences, output_filename):
-    seen = set()
-    with open(output_filename, "w", encoding="utf-8", newline="") as f_out:
-        writer = csv.writer(f_out, delimiter="\t")
-        writer.writerow(["English", "Kabyle"])
-        for sid1, sid2 in iter_links(LINKS_TAR):
-            if sid1 in kab_sentences and sid2 in eng_sentences:
-                key = tuple(sorted([sid1, sid2]))
-                if key in seen:
-                    continue
-                seen.add(key)
-                writer.writerow([eng_sentences[sid2], kab_sentences[sid1]])
-            elif sid2 in kab_sentences and sid1 in eng_sentences:
-                key = tuple(sorted([sid1, sid2]))
-                if key in seen:
-                    continue
-                seen.add(key)
-                writer.writerow([eng_sentences[sid1], kab_sentences[sid2]])
-    print(f"Paires de phrases écrites dans {output_filename}.")
-
-def split_tsv_to_text(tsv_filename, en_out, kab_out):
-    with open(tsv_filename, "r", encoding="utf-8") as infile:
-        reader = csv.DictReader(infile, delimiter="\t")
-        with open(en_out, "w", encoding="utf-8") as en_file, \
-             open(kab_out, "w", encoding="utf-8") as kab_file:
-            for row in reader:
-                english = row.get("English", "").strip()
-                kabyle = row.get("Kabyle", "").strip()
-                if english:
-                    en_file.write(english + "\n")
-                if kabyle:
-                    kab_file.write(kabyle + "\n")
-    print(f"Créé {en_out} et {kab_out} à partir de {tsv_filename}.")
+def split_tsv_to_text(tsv_filename, en_out, kab_out, output_format="tsv"):
+    # Colonnes lues par position : langue partenaire puis langue pivot, quel que soit l'en-tête.
+    # Les fichiers Parquet/Arrow sont lus par colonnes (textes seulement), par lots.
+    # tsv_filename peut aussi être une liste de fichiers (ex: train, dev et test), lus à la suite.
+    pair_files = [tsv_filename] if isinstance(tsv_filename, str) else tsv_filename
+    with open(en_out, "w", encoding="utf-8") as en_file, \
+         open(kab_out, "w", encoding="utf-8") as kab_file:
+        for english, kabyle in (pair for path in pair_files
+                                for pair in pair_output.iter_pair_texts(path, output_format)):
+            english = english.strip()
+            kabyle = kabyle.strip()
+            if english:
+                en_file.write(english + "\n")
+            if kabyle:
+                kab_file.write(kabyle + "\n")
+    print(f"Créé {en_out} et {kab_out} à partir de {', '.join(pair_files)}.")
 
 ### Fonction principale ###
 def main():
     parser = argparse.ArgumentParser(description="Tatoeba Corpus Processing Tool")
-    parser.add_argument("--source_lang", required=True, help="Code ISO pour la langue source (ex: eng)")
-    parser.add_argument("--target_lang", required=True, help="Code ISO pour la langue cible (ex: kab)")
+    parser.add_argument("--source_lang", required=True, nargs="+",
+                        help="Code(s) ISO des langues sources, appariées chacune avec la langue cible "
+                             "(ex: eng, ou eng fra deu)")
+    parser.add_argument("--target_lang", required=True, help="Code ISO pour la langue cible (pivot, ex: kab)")
     parser.add_argument("--output_dir", default="corpus", help="Répertoire de sortie (défaut: corpus)")
     parser.add_argument("--exclude_file", help="Fichier contenant les mots à exclure (un par ligne)")
     parser.add_argument("--rel_cutoff", type=float, default=0.005,
@@ -171,63 +93,196 @@ def main():
                         help="Seuil de fréquence absolue (défaut: 5)")
     parser.add_argument("--max_words", type=int, default=500,
                         help="Nombre maximum de stopwords à conserver (défaut: 500)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processus pour la décompression bz2 parallèle par blocs (défaut: 1 = désactivée)")
+    parser.add_argument("--download_workers", type=int, default=downloader.DOWNLOAD_WORKERS,
+                        help="Connexions parallèles par fichier téléchargé, par plages d'octets, "
+                             f"avec reprise après interruption (défaut: {downloader.DOWNLOAD_WORKERS})")
+    parser.add_argument("--stream_download", action="store_true",
+                        help="Extrait les paires pendant le téléchargement des exports (lecture du fichier "
+                             "en cours d'écriture) au lieu d'attendre la fin des téléchargements")
+    parser.add_argument("--export", choices=["auto", "full", "per_language"], default="auto",
+                        help="Exports Tatoeba à utiliser : archives complètes, fichiers par langue, "
+                             "ou auto = par langue quand peu de langues sont demandées (défaut: auto)")
+    parser.add_argument("--memory_limit", "--memory-limit", type=external_join.parse_size, default=None,
+                        help="Borne la mémoire de l'extraction des paires (ex: 2G) en triant sur disque "
+                             "(défaut: tout en mémoire)")
+    parser.add_argument("--tmp_dir", default=None,
+                        help="Répertoire des fichiers temporaires de --memory_limit (défaut: celui du système)")
+    parser.add_argument("--clusters", action="store_true",
+                        help="Écrit aussi <cible>_clusters.jsonl : un groupe de traductions par ligne, "
+                             "phrases regroupées par langue")
+    parser.add_argument("--format", choices=sorted(pair_output.FORMATS), default="tsv",
+                        help="Format des fichiers de paires : tsv, ou parquet / arrow (colonnes ids et textes "
+                             "des deux langues, nécessite pyarrow) (défaut: tsv)")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="Découpe chaque TSV de paires en N fichiers compressés (répertoire avec manifest.json), "
+                             "chaque paire allant au fichier donné par le hachage de ses IDs (défaut: 1 = un seul TSV)")
+    parser.add_argument("--compression", choices=sorted(pair_output.COMPRESSIONS), default=None,
+                        help="Compression des fichiers de --shards (défaut: zstd si le module zstandard est installé, "
+                             "sinon gzip)")
+    parser.add_argument("--split", type=pair_output.parse_splits, default=None,
+                        help="Répartit les paires en fichiers train/dev/test pendant l'écriture, par hachage stable "
+                             "de leur groupe de traductions (ex: train=0.98,dev=0.01,test=0.01)")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Supprime à l'écriture les paires dont les textes, normalisés (casse, ponctuation, "
+                             "espaces), répètent ceux d'une paire précédente (au lieu de sort | uniq)")
+    parser.add_argument("--delta", action="store_true",
+                        help="Mode incrémental : compare le nouvel instantané à l'index du précédent "
+                             "(<output_dir>/snapshot_index), écrit delta_report.tsv et ne refait que ce qui a changé")
     args = parser.parse_args()
+    if args.shards > 1 and args.format != "tsv":
+        parser.error("--shards ne s'applique qu'au format tsv.")
+    if args.format != "tsv" and pair_output.pa is None:
+        parser.error(f"--format {args.format} nécessite pyarrow (pip install pyarrow).")
+    if args.delta and args.memory_limit is not None:
+        parser.error("--delta garde les phrases en mémoire et ne s'utilise pas avec --memory_limit.")
+    if args.clusters and args.memory_limit is not None:
+        parser.error("--clusters garde les phrases en mémoire et ne s'utilise pas avec --memory_limit.")
     
-    source_lang = args.source_lang
+    source_langs = list(dict.fromkeys(args.source_lang))
+    source_lang = source_langs[0]
     target_lang = args.target_lang
     output_dir = args.output_dir
     
     if not os.path.isdir(output_dir):
         os.makedirs(output_dir)
     
-    OUTPUT_TSV = os.path.join(output_dir, f"{source_lang}_{target_lang}_sentence_pairs.tsv")
-    EN_OUTPUT = os.path.join(output_dir, f"{source_lang}.txt")
+    # Un TSV par langue source ; kab.txt (puis la correction et les stopwords) vient de
+    # la première langue source, les autres donnent <cible>_<source>.txt.
+    extension = pair_output.FORMATS[args.format] if args.shards <= 1 else ""
+    OUTPUT_TSVS = {lang: os.path.join(output_dir, f"{lang}_{target_lang}_sentence_pairs{extension}")
+                   for lang in source_langs}
+    # Avec --split, chaque TSV est écrit en un fichier par partie (train, dev, test...).
+    PAIR_FILES = {lang: ([pair_output.split_path(path, name) for name in args.split] if args.split else [path])
+                  for lang, path in OUTPUT_TSVS.items()}
+    CLUSTERS_OUTPUT = os.path.join(output_dir, f"{target_lang}_clusters.jsonl")
     KAB_OUTPUT = os.path.join(output_dir, f"{target_lang}.txt")
     KAB_FIXED = os.path.join(output_dir, f"{target_lang}_fixed.txt")
     STOPWORDS_OUTPUT = os.path.join(output_dir, "kab_stopwords.txt")
+    INDEX_DIR = os.path.join(output_dir, delta.INDEX_DIR_NAME)
+    REPORT_OUTPUT = os.path.join(output_dir, delta.REPORT_NAME)
     
-    with yaspin(text="Téléchargement de l'archive des phrases...", color="cyan") as spinner:
-        download_file(SENTENCES_URL, SENTENCES_TAR)
-        spinner.ok("✔")
-    with yaspin(text="Téléchargement de l'archive des liens...", color="cyan") as spinner:
-        download_file(LINKS_URL, LINKS_TAR)
-        spinner.ok("✔")
-    
-    with yaspin(text="Construction du dictionnaire de phrases en kabyle...", color="cyan") as spinner:
-        kab_sentences = build_kab_sentence_dict()
-        spinner.ok("✔")
-    
-    with yaspin(text="Collecte des IDs anglais candidats...", color="cyan") as spinner:
-        eng_ids_needed = build_eng_ids_needed(kab_sentences)
-        spinner.ok("✔")
+    sentence_exports, link_exports = downloader.plan_exports(target_lang, source_langs, args.export)
+    downloads = dict(list(sentence_exports.values()) + list(link_exports.values()))
+    sentence_sources = {lang: filename for lang, (url, filename) in sentence_exports.items()}
+    link_sources = {lang: filename for lang, (url, filename) in link_exports.items()}
+    if not args.stream_download:
+        # Toutes les archives sont téléchargées en même temps, avec une progression commune ;
+        # si un téléchargement échoue, les autres sont arrêtés (leurs plages finies sont gardées).
+        with yaspin(text=f"Téléchargement de {len(downloads)} fichiers...", color="cyan") as spinner:
+            def show(progress):
+                spinner.text = f"Téléchargement de {len(downloads)} fichiers : {progress}"
+            downloader.download_all(downloads, args.download_workers, downloader.DownloadProgress(show))
+            spinner.ok("✔")
     
-    with yaspin(text="Chargement des phrases anglaises...", color="cyan") as spinner:
-        eng_sentences = build_eng_sentence_dict(eng_ids_needed)
+    # Plan en deux passes : un parcours des phrases (toutes les langues), un parcours des liens,
+    # qui écrivent ensemble les paires de toutes les langues sources.
+    with yaspin(text="Extraction des paires de phrases (phrases puis liens)...", color="cyan") as spinner:
+        headers = {lang: (LANGUAGE_NAMES.get(lang, lang), LANGUAGE_NAMES.get(target_lang, target_lang))
+                   for lang in source_langs}
+        if args.stream_download:
+            # Les exports sont lus pendant leur téléchargement : chaque passe lit le fichier
+            # en cours d'écriture (downloader.TeeStream) et n'attend que les octets manquants.
+            def show(progress):
+                spinner.text = f"Téléchargement et extraction des paires : {progress}"
+            cancel_downloads = threading.Event()
+            tees, downloads_done = downloader.stream_downloads(downloads, args.download_workers,
+                                                               downloader.DownloadProgress(show), cancel_downloads)
+            files = (sentence_sources, link_sources)
+            sentence_sources = {lang: tees[filename] for lang, filename in files[0].items()}
+            link_sources = {lang: tees[filename] for lang, filename in files[1].items()}
+        try:
+            # --delta et --clusters réutilisent les phrases et les paires gardées en mémoire.
+            if args.delta or args.clusters:
+                texts, pairs, passes = planner.collect_pairs(sentence_sources, link_sources, target_lang,
+                                                             source_langs, workers=args.workers)
+                if not args.delta:
+                    planner.write_pivot_pairs(texts, pairs, target_lang, source_langs, OUTPUT_TSVS,
+                                              headers=headers, output_format=args.format, shards=args.shards,
+                                              compression=args.compression, splits=args.split, dedup=args.dedup)
+            elif args.memory_limit is None:
+                passes = planner.extract_pivot_pairs(
+                    sentence_sources, link_sources, target_lang, source_langs, OUTPUT_TSVS,
+                    headers=headers, workers=args.workers, output_format=args.format,
+                    shards=args.shards, compression=args.compression, splits=args.split, dedup=args.dedup)
+            else:
+                passes = external_join.extract_pivot_pairs(
+                    sentence_sources, link_sources, target_lang, source_langs, OUTPUT_TSVS,
+                    headers=headers, workers=args.workers, memory_limit=args.memory_limit, tmp_dir=args.tmp_dir,
+                    output_format=args.format, shards=args.shards, compression=args.compression,
+                    splits=args.split, dedup=args.dedup)
+        except BaseException:
+            if args.stream_download:
+                # Sans quoi les téléchargements en cours iraient jusqu'au bout avant que le script s'arrête.
+                cancel_downloads.set()
+            raise
+        if args.stream_download:
+            downloads_done.result()
+            for tee in tees.values():
+                tee.close()
+            # Les étapes suivantes relisent les fichiers téléchargés.
+            sentence_sources, link_sources = files
         spinner.ok("✔")
+        print(f"Paires extraites en {passes} passes sur les fichiers d'export.")
+
+    if args.delta:
+        # Tout ce dont dépendent les sorties, hormis les exports eux-mêmes.
+        settings = {"target_lang": target_lang, "source_langs": source_langs, "format": args.format,
+                    "shards": args.shards, "compression": args.compression, "split": args.split,
+                    "dedup": args.dedup,
+                    "clusters": args.clusters, "rel_cutoff": args.rel_cutoff, "min_count": args.min_count,
+                    "max_words": args.max_words, "exclude_file": args.exclude_file, "fix_mapping": FIX_MAPPING}
+        snapshot = delta.SnapshotIndex.build(texts, pairs, {"settings": settings})
+        previous = delta.SnapshotIndex.load(INDEX_DIR)
+        reuse_fixed = False
+        if previous is None:
+            print(f"Pas d'index dans {INDEX_DIR} : traitement complet.")
+        else:
+            summary = delta.write_report(previous, snapshot, REPORT_OUTPUT)
+            for (change, lang), count in sorted(summary.items()):
+                print(f"{change} ({lang}) : {count}")
+            print(f"Rapport des changements écrit dans {REPORT_OUTPUT}.")
+            previous_settings = previous.meta.get("settings", {})
+            # Les fréquences sauvegardées ne valent que pour le kab_fixed.txt écrit avec elles.
+            reuse_fixed = (previous_settings.get("fix_mapping") == FIX_MAPPING
+                           and previous.word_counts is not None and os.path.isfile(KAB_FIXED)
+                           and previous.meta.get("fixed_key") == list(archive_key(KAB_FIXED)))
+            if not summary and reuse_fixed and previous_settings == settings \
+                    and os.path.isfile(STOPWORDS_OUTPUT) \
+                    and all(os.path.exists(path) for paths in PAIR_FILES.values() for path in paths) \
+                    and (not args.clusters or os.path.isfile(CLUSTERS_OUTPUT)):
+                print("Aucun changement depuis l'instantané précédent : sorties inchangées.")
+                return
+        previous_fixed, previous_lines = (delta.read_fixed_lines(KAB_OUTPUT, KAB_FIXED) if reuse_fixed
+                                          else ({}, None))
+        planner.write_pivot_pairs(texts, pairs, target_lang, source_langs, OUTPUT_TSVS, headers=headers,
+                                  output_format=args.format, shards=args.shards,
+                                  compression=args.compression, splits=args.split, dedup=args.dedup)
     
-    with yaspin(text="Écriture des paires de phrases dans le TSV...", color="cyan") as spinner:
-        write_sentence_pairs(eng_sentences, kab_sentences, OUTPUT_TSV)
-        spinner.ok("✔")
+    if args.clusters:
+        with yaspin(text="Regroupement des traductions en clusters...", color="cyan") as spinner:
+            clusters.write_pivot_clusters(texts, pairs, target_lang, source_langs, CLUSTERS_OUTPUT)
+            spinner.ok("✔")
     
-    with yaspin(text="Séparation du TSV en eng.txt et kab.txt...", color="cyan") as spinner:
-        split_tsv_to_text(OUTPUT_TSV, EN_OUTPUT, KAB_OUTPUT)
-        spinner.ok("✔")
+    for lang in source_langs:
+        pivot_output = KAB_OUTPUT if lang == source_lang else os.path.join(output_dir, f"{target_lang}_{lang}.txt")
+        with yaspin(text=f"Séparation du TSV en {lang}.txt et {os.path.basename(pivot_output)}...",
+                    color="cyan") as spinner:
+            split_tsv_to_text(PAIR_FILES[lang], os.path.join(output_dir, f"{lang}.txt"), pivot_output, args.format)
+            spinner.ok("✔")
     
     # Correction du fichier kab.txt à l'aide du module fixer
     with yaspin(text="Correction de kab.txt...", color="cyan") as spinner:
-        fix_mapping = {
-            'ţţ': 'tt',
-            'țț': 'tt',
-            'ε': 'ɛ',
-            'ϵ': 'ɛ',
-            'γ': 'ɣ',
-            'Γ': 'Ɣ',
-            'Σ': 'Ɛ',
-            'Ԑ': 'Ɛ',
-            'ğ': 'ǧ',
-            'ş': 'ṣ'
-        }
-        num_fixed = fixer.fix_file(KAB_OUTPUT, KAB_FIXED, fix_mapping)
+        if args.delta:
+            # Seules les lignes absentes du kab.txt précédent sont corrigées ; les fréquences
+            # des mots sont mises à jour avec les lignes ajoutées ou retirées.
+            word_counts = previous.word_counts if reuse_fixed else None
+            num_fixed, recomputed = delta.patch_fixed_file(KAB_OUTPUT, KAB_FIXED, previous_fixed, FIX_MAPPING,
+                                                           previous_lines, word_counts)
+            print(f"{recomputed} lignes nouvelles ou modifiées corrigées, les autres reprises de l'exécution précédente.")
+        else:
+            num_fixed = fixer.fix_file(KAB_OUTPUT, KAB_FIXED, FIX_MAPPING)
         spinner.ok("✔")
         print(f"{num_fixed} lignes corrigées dans {KAB_OUTPUT}. Fichier corrigé sauvegardé sous '{KAB_FIXED}'.")
     
@@ -239,17 +294,32 @@ def main():
             with open(args.exclude_file, encoding="utf-8") as f:
                 exclude_set = {line.strip() for line in f if line.strip()}
         # ---- 2.  generate stopwords ---------------------------------------------
-        stopwords = kab_stopwords.create_stopwords(
-            KAB_FIXED,
-            STOPWORDS_OUTPUT,
-            rel_cutoff=args.rel_cutoff,
-            min_count=args.min_count,
-            max_words=args.max_words,
-            exclude=exclude_set          # <-- pass the set, not the file name
-        )
+        if args.delta:
+            if word_counts is None:
+                with open(KAB_FIXED, encoding="utf-8") as f:
+                    word_counts = kab_stopwords.count_words(f.read())
+            stopwords = kab_stopwords.select_stopwords(
+                word_counts, STOPWORDS_OUTPUT, rel_cutoff=args.rel_cutoff, min_count=args.min_count,
+                max_words=args.max_words, exclude=exclude_set)
+        else:
+            stopwords = kab_stopwords.create_stopwords(
+                KAB_FIXED,
+                STOPWORDS_OUTPUT,
+                rel_cutoff=args.rel_cutoff,
+                min_count=args.min_count,
+                max_words=args.max_words,
+                exclude=exclude_set          # <-- pass the set, not the file name
+            )
         spinner.ok("✔")
         print(f"Liste de stopwords créée avec {len(stopwords)} mots et sauvegardée dans {STOPWORDS_OUTPUT}.")
 
+    if args.delta:
+        # L'index est écrit en dernier : il ne décrit que des sorties complètes.
+        snapshot.word_counts = word_counts
+        snapshot.meta["fixed_key"] = list(archive_key(KAB_FIXED))
+        snapshot.save(INDEX_DIR)
+        print(f"Index de l'instantané sauvegardé dans {INDEX_DIR}.")
+
     print("Toutes les étapes sont terminées.")
 
 if __name__ == "__main__":
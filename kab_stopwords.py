@@ -12,39 +12,28 @@ KABYLE_PATTERN = rf"[{KABYLE_CORE}{KABYLE_CORE.upper()}]+"
 EXCLUDE = {"mary"}
 
 
-def create_stopwords(input_filename, output_filename,
+def count_words(text):
+    """
+    Normalise le texte en NFC, le tokenize avec l'alphabet kabyle CLDR et renvoie
+    un Counter de la fréquence de chaque mot (en minuscules). Compter un texte ligne
+    par ligne donne les mêmes fréquences que le compter en entier.
+    """
+    text = unicodedata.normalize('NFC', text)
+    return Counter(re.findall(KABYLE_PATTERN, text.lower()))
+
+
+def select_stopwords(freq, output_filename,
                      rel_cutoff=0.005, min_count=0, max_words=None, exclude=None):
     """
-    Lit le fichier 'input_filename', normalise et tokenize le texte en utilisant
-    uniquement l'alphabet kabyle CLDR, calcule la fréquence de chaque mot et écrit
-    dans 'output_filename' la liste des mots apparaissant au moins 'rel_cutoff'
-    (proportion du corpus) ou au moins 'min_count' fois, sauf ceux dans 'exclude'.
-    Peut aussi limiter la liste aux 'max_words' les plus fréquents.
+    Sélectionne et sauvegarde les stopwords à partir des fréquences 'freq' (un Counter,
+    par ex. celui de count_words), avec les mêmes seuils que create_stopwords.
 
-    Args:
-        input_filename (str): Le fichier source (par ex. kab_fixed.txt).
-        output_filename (str): Le fichier où sauvegarder la liste de stopwords.
-        rel_cutoff (float): Seuil de fréquence relative (0 = désactivé).
-        min_count (int): Seuil de fréquence absolue (0 = désactivé).
-        max_words (int): Nombre maximum de stopwords à garder (défaut: None).
-        exclude (set): Ensemble de mots à exclure (défaut: EXCLUDE global).
-        
     Returns:
         list: La liste des candidats stopwords.
     """
     if exclude is None:
         exclude = EXCLUDE
 
-    # Lire et normaliser en NFC
-    with open(input_filename, "r", encoding="utf-8") as f:
-        text = f.read()
-    text = unicodedata.normalize('NFC', text)
-    
-    # Tokenisation basée sur l’alphabet Kabyle
-    tokens = re.findall(KABYLE_PATTERN, text.lower())
-    
-    # Calcul des fréquences
-    freq = Counter(tokens)
     total_tokens = sum(freq.values())
     
     # Sélectionner les mots selon les seuils
@@ -57,10 +46,10 @@ def create_stopwords(input_filename, output_filename,
         )
     ]
     
-    # Trier par fréquence décroissante
+    # Trier par fréquence décroissante (puis par ordre alphabétique, pour que le résultat
+    # ne dépende pas de l'ordre dans lequel les mots ont été comptés)
     candidate_stopwords = sorted(candidate_stopwords,
-                                 key=lambda w: freq[w],
-                                 reverse=True)
+                                 key=lambda w: (-freq[w], w))
 
     # Limiter au top-N si demandé
     if max_words is not None:
@@ -74,6 +63,34 @@ def create_stopwords(input_filename, output_filename,
     return candidate_stopwords
 
 
+def create_stopwords(input_filename, output_filename,
+                     rel_cutoff=0.005, min_count=0, max_words=None, exclude=None):
+    """
+    Lit le fichier 'input_filename', normalise et tokenize le texte en utilisant
+    uniquement l'alphabet kabyle CLDR, calcule la fréquence de chaque mot et écrit
+    dans 'output_filename' la liste des mots apparaissant au moins 'rel_cutoff'
+    (proportion du corpus) ou au moins 'min_count' fois, sauf ceux dans 'exclude'.
+    Peut aussi limiter la liste aux 'max_words' les plus fréquents.
+
+    Args:
+        input_filename (str): Le fichier source (par ex. kab_fixed.txt).
+        output_filename (str): Le fichier où sauvegarder la liste de stopwords.
+        rel_cutoff (float): Seuil de fréquence relative (0 = désactivé).
+        min_count (int): Seuil de fréquence absolue (0 = désactivé).
+        max_words (int): Nombre maximum de stopwords à garder (défaut: None).
+        exclude (set): Ensemble de mots à exclure (défaut: EXCLUDE global).
+        
+    Returns:
+        list: La liste des candidats stopwords.
+    """
+    # Lire le fichier, puis tokeniser (alphabet kabyle) et compter les mots
+    with open(input_filename, "r", encoding="utf-8") as f:
+        freq = count_words(f.read())
+
+    return select_stopwords(freq, output_filename, rel_cutoff=rel_cutoff, min_count=min_count,
+                            max_words=max_words, exclude=exclude)
+
+
 if __name__ == "__main__":
     import argparse
 
@@ -99,9 +116,7 @@ if __name__ == "__main__":
 
     # Recompute frequencies for inspection
     with open(args.input, "r", encoding="utf-8") as f:
-        text = unicodedata.normalize('NFC', f.read())
-    tokens = re.findall(KABYLE_PATTERN, text.lower())
-    freq = Counter(tokens)
+        freq = count_words(f.read())
     total_tokens = sum(freq.values())
 
     print(f"Top {args.top} stopword candidates:")
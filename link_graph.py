@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+CSR Link Graph
+
+The links of a Tatoeba export as an undirected graph in compressed sparse row
+form, indexed directly by sentence ID:
+
+    neighbors[offsets[sid]:offsets[sid + 1]]   the sentences linked to sid
+
+offsets is an int64 array (one entry per sentence ID, plus one) and neighbors a
+uint32 array holding each link in both directions, without duplicates. The graph
+is built once from links.csv and cached next to the archive (links.tar.bz2.graph),
+keyed by the archive's size and mtime like the row cache.
+
+hop_pairs() finds the pairs of sentences joined by a path of at most max_hops
+links (kab→fra→eng for max_hops=2) by expanding the frontier of all the start
+sentences at once. It uses NumPy when it is installed, and a per-sentence
+breadth-first search otherwise.
+
+Usage as a command-line tool (build the cache once):
+    python3 link_graph.py --links_tar links.tar.bz2
+"""
+
+import argparse
+import os
+import struct
+import sys
+from array import array
+
+from extractor import archive_key, is_archive_path
+from link_table import LinkTable, load_link_table
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+GRAPH_SUFFIX = ".graph"
+GRAPH_MAGIC = b"KABNLPG1"
+# magic, archive size, archive mtime_ns, number of offsets, number of neighbors
+GRAPH_HEADER = struct.Struct("<8sqqqq")
+HOP_CHUNK_SIZE = 100000
+
+class LinkGraph:
+    """Undirected link graph in CSR form (see the module docstring)."""
+
+    def __init__(self, offsets, neighbors):
+        self.offsets = offsets
+        self.neighbors = neighbors
+
+    def __len__(self):
+        """Number of sentence IDs covered (highest linked ID + 1)."""
+        return len(self.offsets) - 1
+
+    def neighbors_of(self, sid):
+        """Return the IDs linked to sentence sid."""
+        if not 0 <= sid < len(self):
+            return array('I')
+        return self.neighbors[self.offsets[sid]:self.offsets[sid + 1]]
+
+    def save(self, path, key=(0, 0)):
+        """Write the graph to path, tagged with the (size, mtime_ns) key of its archive."""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(GRAPH_HEADER.pack(GRAPH_MAGIC, key[0], key[1], len(self.offsets), len(self.neighbors)))
+            for column in (self.offsets, self.neighbors):
+                if sys.byteorder == "big":
+                    column = array(column.typecode, column)
+                    column.byteswap()
+                column.tofile(f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, key=None):
+        """Read a graph written by save(); returns None if it is missing, truncated or its key differs."""
+        try:
+            with open(path, "rb") as f:
+                header = f.read(GRAPH_HEADER.size)
+                if len(header) != GRAPH_HEADER.size:
+                    return None
+                magic, size, mtime_ns, n_offsets, n_neighbors = GRAPH_HEADER.unpack(header)
+                if magic != GRAPH_MAGIC or (key is not None and (size, mtime_ns) != key):
+                    return None
+                offsets = array('q')
+                offsets.fromfile(f, n_offsets)
+                neighbors = array('I')
+                neighbors.fromfile(f, n_neighbors)
+        except (OSError, EOFError):
+            return None
+        if sys.byteorder == "big":
+            offsets.byteswap()
+            neighbors.byteswap()
+        return cls(offsets, neighbors)
+
+def graph_path(links_tar_filename):
+    return os.path.abspath(links_tar_filename) + GRAPH_SUFFIX
+
+def build_link_graph(table):
+    """Build the LinkGraph of a LinkTable."""
+    if not len(table):
+        return LinkGraph(array('q', [0]), array('I'))
+    size = max(max(table.sources), max(table.targets)) + 1
+    if np is not None:
+        sources = np.frombuffer(table.sources, dtype=np.int64)
+        targets = np.frombuffer(table.targets, dtype=np.int64)
+        keys = np.unique(np.concatenate((sources << 32 | targets, targets << 32 | sources)))
+        counts = np.bincount(keys >> 32, minlength=size)
+        offsets = array('q', bytes(8))
+        offsets.frombytes(np.cumsum(counts, dtype=np.int64).tobytes())
+        return LinkGraph(offsets, array('I', (keys & 0xFFFFFFFF).astype(np.uint32).tobytes()))
+    # Counting sort by source ID, then sort and deduplicate each neighbor list.
+    counts = array('q', bytes(8 * (size + 1)))
+    for sid1, sid2 in table:
+        counts[sid1 + 1] += 1
+        counts[sid2 + 1] += 1
+    for sid in range(size):
+        counts[sid + 1] += counts[sid]
+    fill = array('q', counts)
+    neighbors = array('I', bytes(4 * counts[size]))
+    for sid1, sid2 in table:
+        neighbors[fill[sid1]] = sid2
+        fill[sid1] += 1
+        neighbors[fill[sid2]] = sid1
+        fill[sid2] += 1
+    offsets = array('q', [0])
+    unique = array('I')
+    for sid in range(size):
+        unique.extend(sorted(set(neighbors[counts[sid]:counts[sid + 1]])))
+        offsets.append(len(unique))
+    return LinkGraph(offsets, unique)
+
+def load_link_graph(links, workers=1, use_cache=True):
+    """
+    Return the LinkGraph of links: a LinkTable, or a links archive (or per-pair links
+    export) whose cached graph is used when up to date, and written otherwise.
+    """
+    if isinstance(links, LinkTable):
+        return build_link_graph(links)
+    on_disk = is_archive_path(links)
+    if use_cache and on_disk:
+        graph = LinkGraph.load(graph_path(links), archive_key(links))
+        if graph is not None:
+            print(f"Loaded link graph of {len(graph.neighbors)} neighbors from {graph_path(links)}.")
+            return graph
+    graph = build_link_graph(load_link_table(links, workers=workers))
+    if use_cache and on_disk:
+        graph.save(graph_path(links), archive_key(links))
+    return graph
+
+def hop_pairs(graph, a_ids, b_ids, max_hops=1, chunk_size=HOP_CHUNK_SIZE):
+    """
+    Return the (a, b) pairs, a in a_ids and b in b_ids (int IDs), joined by a path of
+    at most max_hops links, each pair once, sorted by (lower ID, higher ID): the
+    order in which the direct links come in links.csv.
+    """
+    if np is not None:
+        pairs = _hop_pairs_numpy(graph, a_ids, b_ids, max_hops, chunk_size)
+    else:
+        pairs = _hop_pairs_python(graph, a_ids, b_ids, max_hops)
+    pairs.sort(key=lambda pair: (min(pair), max(pair)))
+    return pairs
+
+def _hop_pairs_python(graph, a_ids, b_ids, max_hops):
+    b_ids = set(b_ids)
+    pairs = []
+    for a in sorted(set(a_ids)):
+        seen = {a}
+        frontier = [a]
+        for _ in range(max_hops):
+            next_frontier = []
+            for sid in frontier:
+                for other in graph.neighbors_of(sid):
+                    if other not in seen:
+                        seen.add(other)
+                        next_frontier.append(other)
+                        if other in b_ids:
+                            pairs.append((a, other))
+            frontier = next_frontier
+    return pairs
+
+def _hop_pairs_numpy(graph, a_ids, b_ids, max_hops, chunk_size):
+    offsets = np.frombuffer(graph.offsets, dtype=np.int64)
+    neighbors = np.frombuffer(graph.neighbors, dtype=np.uint32)
+    size = len(graph)
+    a_ids = np.unique(np.fromiter(a_ids, dtype=np.int64))
+    a_ids = a_ids[(a_ids >= 0) & (a_ids < size)]
+    b_ids = np.fromiter(b_ids, dtype=np.int64)
+    is_b = np.zeros(size, dtype=bool)
+    is_b[b_ids[(b_ids >= 0) & (b_ids < size)]] = True
+    found = []
+    for start in range(0, len(a_ids), chunk_size):
+        origins = a_ids[start:start + chunk_size]
+        nodes = origins
+        seen = origins << 32 | origins  # (origin, sentence) keys already reached
+        for _ in range(max_hops):
+            degrees = offsets[nodes + 1] - offsets[nodes]
+            total = int(degrees.sum())
+            if not total:
+                break
+            # Gather every neighbor of every frontier node, tagged with its origin.
+            first = np.repeat(offsets[nodes] - (np.cumsum(degrees) - degrees), degrees)
+            reached = neighbors[first + np.arange(total)].astype(np.int64)
+            keys = np.unique(np.repeat(origins, degrees) << 32 | reached)
+            keys = keys[~np.isin(keys, seen, assume_unique=True)]
+            seen = np.union1d(seen, keys)
+            origins, nodes = keys >> 32, keys & 0xFFFFFFFF
+            found.append(keys[is_b[nodes]])
+    if not found:
+        return []
+    keys = np.concatenate(found)
+    return list(zip((keys >> 32).tolist(), (keys & 0xFFFFFFFF).tolist()))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the CSR link graph cache of a Tatoeba links export.")
+    parser.add_argument("--links_tar", default="links.tar.bz2", help="Links archive (default: links.tar.bz2)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processes for parallel bz2 decoding (default: 1)")
+    args = parser.parse_args()
+
+    graph = load_link_graph(args.links_tar, args.workers)
+    print(f"Link graph of {len(graph)} sentence IDs and {len(graph.neighbors)} neighbors "
+          f"cached in {graph_path(args.links_tar)}.")
@@ -0,0 +1,111 @@
+# link_table.py
+import ast
+import os
+import struct
+import sys
+from array import array
+
+from extractor import (CACHE_HEADER, CACHE_MAGIC, archive_key, cache_path,
+                       is_archive_path, iter_member_blocks)
+
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+
+class LinkTable:
+    """
+    The links of a Tatoeba export as two packed int64 arrays:
+    sentence sources[i] is linked to sentence targets[i].
+    Iterating yields (sentence_id, translation_id) pairs of ints.
+    """
+
+    def __init__(self, sources=None, targets=None):
+        self.sources = sources if sources is not None else array('q')
+        self.targets = targets if targets is not None else array('q')
+        if len(self.sources) != len(self.targets):
+            raise Exception("Link table columns have different lengths.")
+
+    def __len__(self):
+        return len(self.sources)
+
+    def __iter__(self):
+        return zip(self.sources, self.targets)
+
+    def save_npy(self, path):
+        """
+        Write the table as a (2, n) int64 .npy file (row 0: sources, row 1: targets),
+        readable with numpy.load without numpy being needed here.
+        """
+        header = "{'descr': '<i8', 'fortran_order': False, 'shape': (2, %d), }" % len(self)
+        header += " " * (-(len(NPY_MAGIC) + 2 + len(header) + 1) % 64) + "\n"
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(NPY_MAGIC + struct.pack("<H", len(header)) + header.encode("latin1"))
+            for column in (self.sources, self.targets):
+                if sys.byteorder == "big":
+                    column = array('q', column)
+                    column.byteswap()
+                column.tofile(f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load_npy(cls, path):
+        """Read a table written by save_npy."""
+        with open(path, "rb") as f:
+            if f.read(len(NPY_MAGIC)) != NPY_MAGIC:
+                raise Exception(f"{path} is not a version 1.0 .npy file.")
+            header_len, = struct.unpack("<H", f.read(2))
+            header = ast.literal_eval(f.read(header_len).decode("latin1"))
+            shape = header["shape"]
+            if header["descr"] != "<i8" or header["fortran_order"] or len(shape) != 2 or shape[0] != 2:
+                raise Exception(f"{path} does not hold a (2, n) int64 link table.")
+            columns = []
+            for _ in range(2):
+                column = array('q')
+                column.fromfile(f, shape[1])
+                if sys.byteorder == "big":
+                    column.byteswap()
+                columns.append(column)
+        return cls(*columns)
+
+def _load_from_cache(tar_filename):
+    """Build the table from the binary row cache of extractor.iter_links, if it is valid."""
+    path = cache_path(tar_filename)
+    try:
+        with open(path, "rb") as f:
+            header = f.read(CACHE_HEADER.size)
+            if len(header) != CACHE_HEADER.size:
+                return None
+            magic, kind, size, mtime_ns = CACHE_HEADER.unpack(header)
+            if magic != CACHE_MAGIC or kind != b"L" or (size, mtime_ns) != archive_key(tar_filename):
+                return None
+            ids = array('I')
+            ids.frombytes(f.read())
+    except OSError:
+        return None
+    if sys.byteorder == "big":
+        ids.byteswap()
+    return LinkTable(array('q', ids[0::2]), array('q', ids[1::2]))
+
+def load_link_table(tar_filename, npy_path=None, workers=1):
+    """
+    Load the links of tar_filename (a path, STDIN or a file object) into a LinkTable.
+    If npy_path is given and is newer than the archive, the table is read from it;
+    otherwise it is built (from the iter_links row cache when valid, else by parsing
+    links.csv bytes straight into integers) and saved to npy_path.
+    """
+    on_disk = is_archive_path(tar_filename)
+    if npy_path and on_disk and os.path.exists(npy_path) \
+            and os.path.getmtime(npy_path) >= os.path.getmtime(tar_filename):
+        table = LinkTable.load_npy(npy_path)
+        print(f"Loaded {len(table)} links from {npy_path}.")
+        return table
+    table = _load_from_cache(tar_filename) if on_disk else None
+    if table is None:
+        table = LinkTable()
+        for lines in iter_member_blocks(tar_filename, "links", "links", workers):
+            rows = [parts for parts in [line.split(b"\t") for line in lines] if len(parts) >= 2]
+            table.sources.extend([int(parts[0]) for parts in rows])
+            table.targets.extend([int(parts[1]) for parts in rows])
+    print(f"Loaded {len(table)} links from {tar_filename if on_disk else 'stream'}.")
+    if npy_path:
+        table.save_npy(npy_path)
+    return table
@@ -0,0 +1,422 @@
+# pair_output.py
+"""
+Pair Output Formats
+
+Writers for the sentence pairs produced by pairing.py, planner.py and
+external_join.py:
+
+    tsv      one row per pair with the two texts (the default)
+    parquet  columns <A>_id, <A>, <B>_id, <B>: the IDs and texts of both languages
+    arrow    the same columns in an Arrow IPC file, which readers can memory-map
+
+where <A> and <B> are the names of the header row (e.g. English, Kabyle). The
+columnar writers buffer batch_size pairs and write them as one record batch, so
+memory stays bounded whatever the number of pairs. They need pyarrow
+(pip install pyarrow), which is otherwise not needed by the toolkit.
+
+A TSV can also be split into N compressed shards (a directory of
+part-00000.tsv.gz, ... with a manifest.json of row counts), each pair going to
+the shard given by a hash of its two sentence IDs. Shards are compressed with
+gzip, or zstd when the zstandard package is installed, in worker threads.
+
+Finally, the pairs can be routed while they are written to train/dev/test
+files (e.g. eng_kab_sentence_pairs.train.tsv) by a stable hash of their group:
+the lowest sentence ID of the cluster of pairs they belong to. Sentences shared
+by several pairs then never cross splits, and a pair keeps its split from one
+Tatoeba snapshot to the next as long as its cluster does.
+
+With dedup, pairs whose texts are the same once normalized (NFKC, case-folded,
+punctuation removed, whitespace collapsed) as an earlier pair are dropped while
+writing, instead of by a sort | uniq pass over the output. Only a 64-bit hash of
+each normalized pair is kept, in a UInt64Set (12 to 24 bytes per pair).
+"""
+
+import contextlib
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import unicodedata
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from id_sets import _FIB, _MASK64, UInt64Set, UnionFind, pair_key
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FORMATS = {"tsv": ".tsv", "parquet": ".parquet", "arrow": ".arrow"}
+ARROW_BATCH_SIZE = 65536
+COMPRESSIONS = {"gzip": ".gz", "zstd": ".zst"}
+SHARD_CHUNK_SIZE = 1 << 20  # characters buffered per shard before compressing them
+MANIFEST_NAME = "manifest.json"
+_SPACES = re.compile(r"\s+")
+
+def _require_pyarrow():
+    if pa is None:
+        raise Exception("Parquet and Arrow output need pyarrow (pip install pyarrow).")
+
+class TsvPairWriter:
+    """Writes the header row, then the two texts of each pair; IDs are not written."""
+
+    def __init__(self, path, header):
+        self._file = open(path, "w", encoding="utf-8", newline="")
+        self._writer = csv.writer(self._file, delimiter="\t")
+        self._writer.writerow(list(header))
+
+    def write(self, sid_a, text_a, sid_b, text_b, group=None):
+        self._writer.writerow([text_a, text_b])
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class ArrowPairWriter:
+    """Writes the pairs as Parquet or Arrow IPC record batches of batch_size rows."""
+
+    def __init__(self, path, header, output_format="parquet", batch_size=ARROW_BATCH_SIZE):
+        _require_pyarrow()
+        name_a, name_b = header
+        self.schema = pa.schema([(f"{name_a}_id", pa.int64()), (name_a, pa.string()),
+                                 (f"{name_b}_id", pa.int64()), (name_b, pa.string())])
+        self.batch_size = batch_size
+        self._sink = None
+        if output_format == "parquet":
+            self._writer = pq.ParquetWriter(path, self.schema)
+        else:
+            self._sink = pa.OSFile(path, "wb")
+            self._writer = pa.ipc.new_file(self._sink, self.schema)
+        self._columns = ([], [], [], [])
+
+    def write(self, sid_a, text_a, sid_b, text_b, group=None):
+        for column, value in zip(self._columns, (int(sid_a), text_a, int(sid_b), text_b)):
+            column.append(value)
+        if len(self._columns[0]) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._columns[0]:
+            return
+        arrays = [pa.array(column, type=field.type) for column, field in zip(self._columns, self.schema)]
+        self._writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+        self._columns = ([], [], [], [])
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+        if self._sink is not None:
+            self._sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def default_compression():
+    """zstd when the zstandard package is installed, gzip otherwise."""
+    return "zstd" if zstandard is not None else "gzip"
+
+def shard_of(sid_a, sid_b, shards):
+    """Return the shard (0 to shards - 1) of the pair {sid_a, sid_b}, whatever the order of the IDs."""
+    return (pair_key(int(sid_a), int(sid_b)) * _FIB & _MASK64) * shards >> 64
+
+class ShardedPairWriter:
+    """
+    Writes the pairs as TSV shards in directory, compressed in worker threads (one
+    thread per group of shards, so each shard's chunks are written in order), and
+    a manifest.json listing each shard's file and row count.
+    """
+
+    def __init__(self, directory, header, shards, compression=None):
+        compression = compression or default_compression()
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression: {compression!r}")
+        if compression == "zstd" and zstandard is None:
+            raise Exception("zstd compression needs the zstandard package (pip install zstandard).")
+        self.directory = directory
+        self.header = list(header)
+        self.compression = compression
+        os.makedirs(directory, exist_ok=True)
+        manifest_path = os.path.join(directory, MANIFEST_NAME)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        self.names = [f"part-{i:05d}.tsv{COMPRESSIONS[compression]}" for i in range(shards)]
+        self._raw = [open(os.path.join(directory, name), "wb") for name in self.names]
+        if compression == "gzip":
+            self._streams = [gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) for raw in self._raw]
+        else:
+            self._streams = [zstandard.ZstdCompressor().stream_writer(raw) for raw in self._raw]
+        self._executors = [ThreadPoolExecutor(1) for _ in range(min(shards, os.cpu_count() or 1))]
+        self._pending = deque()
+        self._buffers = [io.StringIO() for _ in range(shards)]
+        self._writers = [csv.writer(buffer, delimiter="\t") for buffer in self._buffers]
+        for writer in self._writers:
+            writer.writerow(self.header)
+        self.rows = [0] * shards
+
+    def write(self, sid_a, text_a, sid_b, text_b, group=None):
+        shard = shard_of(sid_a, sid_b, len(self.rows))
+        self._writers[shard].writerow([text_a, text_b])
+        self.rows[shard] += 1
+        if self._buffers[shard].tell() >= SHARD_CHUNK_SIZE:
+            self._flush(shard)
+
+    def _flush(self, shard):
+        buffer = self._buffers[shard]
+        data = buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+        executor = self._executors[shard % len(self._executors)]
+        self._pending.append(executor.submit(self._streams[shard].write, data))
+        # Bound the chunks waiting for a worker.
+        while len(self._pending) > 2 * len(self._executors):
+            self._pending.popleft().result()
+
+    def close(self):
+        try:
+            for shard, buffer in enumerate(self._buffers):
+                if buffer.tell():
+                    self._flush(shard)
+            while self._pending:
+                self._pending.popleft().result()
+        finally:
+            for executor in self._executors:
+                executor.shutdown()
+            for stream, raw in zip(self._streams, self._raw):
+                stream.close()
+                raw.close()
+        manifest = {
+            "header": self.header,
+            "compression": self.compression,
+            "rows": sum(self.rows),
+            "shards": [{"file": name, "rows": rows, "bytes": os.path.getsize(os.path.join(self.directory, name))}
+                       for name, rows in zip(self.names, self.rows)],
+        }
+        # The manifest is written last: its presence marks a complete output.
+        with open(os.path.join(self.directory, MANIFEST_NAME), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+
+    def abort(self):
+        """Stop after a failure: the partial shards are removed and no manifest is written."""
+        for executor in self._executors:
+            executor.shutdown(cancel_futures=True)
+        self._pending.clear()
+        for stream, raw in zip(self._streams, self._raw):
+            with contextlib.suppress(Exception):
+                stream.close()
+            raw.close()
+        for name in self.names:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(self.directory, name))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def parse_splits(text):
+    """Parse "train=0.98,dev=0.01,test=0.01" into {"train": 0.98, "dev": 0.01, "test": 0.01}."""
+    splits = {}
+    for item in text.split(","):
+        name, sep, fraction = item.partition("=")
+        name = name.strip()
+        try:
+            fraction = float(fraction)
+        except ValueError:
+            fraction = -1
+        if not sep or not name or fraction <= 0 or name in splits:
+            raise ValueError(f"Invalid split specification: {text!r}")
+        splits[name] = fraction
+    return splits
+
+def split_of(group, splits):
+    """
+    Return the name of the split (a key of splits, whose values are the fractions)
+    of a group ID. The same group always goes to the same split.
+    """
+    position = (int(group) * _FIB & _MASK64) / 2 ** 64 * sum(splits.values())
+    for name, fraction in splits.items():
+        if position < fraction:
+            return name
+        position -= fraction
+    return name
+
+def split_path(path, name):
+    """Return the file of split name for the output path: pairs.tsv -> pairs.train.tsv."""
+    root, extension = os.path.splitext(path)
+    return f"{root}.{name}{extension}"
+
+def split_groups(pairs):
+    """
+    Return a function mapping a sentence ID of pairs (an iterable of ID pairs) to its
+    group: the lowest ID of the connected cluster of pairs it belongs to.
+    """
+    union_find = UnionFind()
+    for sid_a, sid_b in pairs:
+        union_find.union(int(sid_a), int(sid_b))
+    return lambda sid: union_find.find(int(sid))
+
+class SplitPairWriter:
+    """Routes each pair, by split_of(group), to one pair writer per split."""
+
+    def __init__(self, path, splits, open_writer):
+        self.splits = splits
+        self.writers = {name: open_writer(split_path(path, name)) for name in splits}
+        self.rows = dict.fromkeys(splits, 0)
+
+    def write(self, sid_a, text_a, sid_b, text_b, group=None):
+        name = split_of(group if group is not None else min(int(sid_a), int(sid_b)), self.splits)
+        self.writers[name].write(sid_a, text_a, sid_b, text_b)
+        self.rows[name] += 1
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        print("Pairs per split: " + ", ".join(f"{name} {rows}" for name, rows in self.rows.items()) + ".")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            for writer in self.writers.values():
+                writer.__exit__(exc_type, *exc)
+
+def normalize_text(text):
+    """The form of a sentence compared by dedup: NFKC, case-folded, without punctuation, single spaces."""
+    text = unicodedata.normalize('NFKC', text).casefold()
+    text = "".join(char for char in text if not unicodedata.category(char).startswith("P"))
+    return _SPACES.sub(" ", text).strip()
+
+def pair_text_hash(text_a, text_b):
+    """64-bit hash of the normalized texts of a pair."""
+    data = f"{normalize_text(text_a)}\t{normalize_text(text_b)}".encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+class DedupPairWriter:
+    """Passes each pair on to writer unless an earlier pair had the same normalized texts."""
+
+    def __init__(self, writer, path):
+        self.writer = writer
+        self.path = path
+        self.seen = UInt64Set()
+        self.dropped = 0
+
+    def write(self, sid_a, text_a, sid_b, text_b, group=None):
+        if self.seen.add(pair_text_hash(text_a, text_b)):
+            self.writer.write(sid_a, text_a, sid_b, text_b, group)
+        else:
+            self.dropped += 1
+
+    def close(self):
+        self.writer.close()
+        print(f"Dropped {self.dropped} text-duplicate pairs from {self.path} (kept {len(self.seen)}).")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.writer.__exit__(exc_type, *exc)
+
+def open_pair_writer(path, header=("LangA", "LangB"), output_format="tsv", batch_size=ARROW_BATCH_SIZE,
+                     shards=1, compression=None, splits=None, dedup=False):
+    """
+    Return a pair writer for output_format (one of FORMATS), to use as a context manager.
+    With shards > 1 (TSV only), path is the directory of the compressed shards.
+    With splits ({name: fraction}), one output per split is written next to path and
+    write() takes the pair's group (see split_groups) as a last argument.
+    With dedup, pairs with the same normalized texts as an earlier pair are dropped
+    (across all the shards or splits); the writer's dropped attribute counts them.
+    """
+    if dedup:
+        return DedupPairWriter(open_pair_writer(path, header, output_format, batch_size, shards,
+                                                compression, splits), path)
+    if splits:
+        return SplitPairWriter(path, splits, lambda split_filename: open_pair_writer(
+            split_filename, header, output_format, batch_size, shards, compression))
+    if output_format not in FORMATS:
+        raise ValueError(f"Unknown pair output format: {output_format!r}")
+    if shards > 1:
+        if output_format != "tsv":
+            raise ValueError("Sharded pair output is only available for TSV.")
+        return ShardedPairWriter(path, header, shards, compression)
+    if output_format == "tsv":
+        return TsvPairWriter(path, header)
+    return ArrowPairWriter(path, header, output_format, batch_size)
+
+def read_pairs_table(path, output_format):
+    """
+    Load a Parquet or Arrow pairs file as a pyarrow Table. Arrow files are
+    memory-mapped, so their columns are read without copying.
+    """
+    _require_pyarrow()
+    if output_format == "parquet":
+        return pq.read_table(path, memory_map=True)
+    return pa.ipc.open_file(pa.memory_map(path)).read_all()
+
+def _open_shard(path, compression):
+    if compression == "gzip":
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    if zstandard is None:
+        raise Exception("Reading zstd shards needs the zstandard package (pip install zstandard).")
+    return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True),
+                            encoding="utf-8", newline="")
+
+def _iter_tsv_texts(infile):
+    reader = csv.reader(infile, delimiter="\t")
+    next(reader, None)
+    for row in reader:
+        yield (row[0] if len(row) > 0 else "", row[1] if len(row) > 1 else "")
+
+def iter_pair_texts(path, output_format="tsv"):
+    """
+    Generator that yields the (text_a, text_b) pairs of a pairs file (or of a
+    directory of TSV shards, shard after shard), one batch at a time for columnar files.
+    """
+    if os.path.isdir(path):
+        with open(os.path.join(path, MANIFEST_NAME), encoding="utf-8") as f:
+            manifest = json.load(f)
+        for shard in manifest["shards"]:
+            with _open_shard(os.path.join(path, shard["file"]), manifest["compression"]) as infile:
+                yield from _iter_tsv_texts(infile)
+        return
+    if output_format == "tsv":
+        with open(path, "r", encoding="utf-8", newline="") as infile:
+            yield from _iter_tsv_texts(infile)
+        return
+    _require_pyarrow()
+    if output_format == "parquet":
+        parquet_file = pq.ParquetFile(path)
+        names = parquet_file.schema_arrow.names
+        batches = parquet_file.iter_batches(columns=[names[1], names[3]])
+    else:
+        reader = pa.ipc.open_file(pa.memory_map(path))
+        batches = (reader.get_batch(i).select([1, 3]) for i in range(reader.num_record_batches))
+    for batch in batches:
+        yield from zip(batch.column(0).to_pylist(), batch.column(1).to_pylist())
@@ -1,15 +1,42 @@
 # pairing.py
-from extractor import iter_sentences, iter_links
+import clusters
+from extractor import iter_links
+import external_join
+from id_sets import IdBitmap, PairKeySet, UnionFind
+from link_graph import hop_pairs, load_link_graph
+from link_table import LinkTable
+from pair_output import open_pair_writer, split_groups
+import planner
+from shards import iter_sentences_by_lang
+
+def _iter_link_ids(links, *dicts):
+    """
+    Return an iterator over the links together with the ID sets to test its IDs
+    against, one per dict. A links archive yields str IDs, tested against the dicts
+    themselves. A LinkTable yields int IDs, tested against an IdBitmap of each
+    dict's keys, built once: each link then costs integer tests only, and texts are
+    looked up with str(sid) for the matching links alone. Dict-like objects that are
+    not dicts (e.g. a sentence_store.LanguageView) accept both and are kept as is.
+    """
+    if isinstance(links, LinkTable):
+        return iter(links), [_id_bitmap(d) if isinstance(d, dict) else d for d in dicts]
+    return iter_links(links), list(dicts)
+
+def _id_bitmap(sentences):
+    ids = IdBitmap()
+    for sid in sentences:
+        ids.add(int(sid))
+    return ids
 
 def build_sentence_dict(tar_filename, lang):
     """
     Iterates over the sentences file and builds a dictionary of sentences for a given language.
+    Only the language's shard is read when a shard store exists (see shards.py).
     Returns a dict mapping sentence_id -> text.
     """
     sentences = {}
-    for sid, sentence_lang, text in iter_sentences(tar_filename):
-        if sentence_lang == lang:
-            sentences[sid] = text
+    for sid, sentence_lang, text in iter_sentences_by_lang(tar_filename, lang):
+        sentences[sid] = text
     print(f"Found {len(sentences)} sentences in '{lang}'.")
     return sentences
 
@@ -17,58 +44,156 @@ def build_candidate_ids(links_tar_filename, ref_dict, other_lang):
     """
     Iterates over the links file and collects a set of sentence IDs that are paired with a sentence in ref_dict.
     The other sentence is assumed to be in other_lang.
+    links_tar_filename may also be a LinkTable.
     Returns a set of candidate sentence IDs.
     """
     candidate_ids = set()
-    for sid1, sid2 in iter_links(links_tar_filename):
-        if sid1 in ref_dict and sid2 not in ref_dict:
-            candidate_ids.add(sid2)
-        elif sid2 in ref_dict and sid1 not in ref_dict:
-            candidate_ids.add(sid1)
+    links, (ref_ids,) = _iter_link_ids(links_tar_filename, ref_dict)
+    for sid1, sid2 in links:
+        if sid1 in ref_ids and sid2 not in ref_ids:
+            candidate_ids.add(str(sid2))
+        elif sid2 in ref_ids and sid1 not in ref_ids:
+            candidate_ids.add(str(sid1))
     print(f"Identified {len(candidate_ids)} candidate sentence IDs for language '{other_lang}'.")
     return candidate_ids
 
 def build_sentence_dict_from_ids(tar_filename, lang, id_set):
     """
     Iterates over the sentences file and builds a dictionary for sentences in a given language
-    whose IDs are in id_set. Returns a dict mapping sentence_id -> text.
+    whose IDs are in id_set, reading only the language's shard when available. Returns a dict mapping sentence_id -> text.
     """
     sentences = {}
-    for sid, sentence_lang, text in iter_sentences(tar_filename):
-        if sentence_lang == lang and sid in id_set:
+    for sid, sentence_lang, text in iter_sentences_by_lang(tar_filename, lang):
+        if sid in id_set:
             sentences[sid] = text
     print(f"Loaded {len(sentences)} sentences in '{lang}' from candidate IDs.")
     return sentences
 
-def write_sentence_pairs(links_tar_filename, dict_a, dict_b, output_filename, a_first=True):
+def write_sentence_pairs(links_tar_filename, dict_a, dict_b, output_filename, a_first=True, max_hops=1,
+                         output_format="tsv", shards=1, compression=None, splits=None, dedup=False):
     """
     Iterates over the links file (streaming) and writes to output_filename
     the sentence pairs when one sentence is in dict_a and the other in dict_b.
     If a_first is True, output (dict_a[sid], dict_b[other]); otherwise, reverse.
+    links_tar_filename may also be a LinkTable.
+    dict_a / dict_b may be sentence_store language views, so text is only read from
+    the store for matching links.
     Duplicate pairs are skipped.
+    With max_hops > 1, sentences joined through up to max_hops links (e.g. kab→fra→eng)
+    are paired too, using the CSR link graph of link_graph.py (cached next to the
+    links archive); pairs are then written sorted by (lower ID, higher ID).
+    output_format "parquet" or "arrow" writes ID and text columns instead of a TSV
+    (see pair_output.py; needs pyarrow).
+    With shards > 1, output_filename is a directory of that many TSV shards, each
+    pair going to the shard of its ID hash, compressed (gzip, or zstd if available,
+    or as given by compression) in worker threads, plus a manifest.json of row counts.
+    With splits ({"train": 0.98, "dev": 0.01, "test": 0.01}), each pair is written to
+    the split file (output_filename with .train, .dev, ... before its extension) given
+    by a stable hash of its cluster (see pair_output.py). The matching pair IDs are
+    then kept in memory until the links are read, to know the clusters.
+    With dedup, a pair is skipped when its texts, normalized (case, punctuation,
+    spacing), hash to the same 64-bit value as an earlier pair's; the number of
+    dropped pairs is printed.
     """
-    seen = set()  # Use sorted tuple of IDs to avoid duplicates.
-    import csv
-    with open(output_filename, "w", encoding="utf-8", newline="") as f_out:
-        writer = csv.writer(f_out, delimiter="\t")
-        writer.writerow(["LangA", "LangB"])
-        for sid1, sid2 in iter_links(links_tar_filename):
-            if sid1 in dict_a and sid2 in dict_b:
-                key = tuple(sorted([sid1, sid2]))
-                if key in seen:
-                    continue
-                seen.add(key)
-                if a_first:
-                    writer.writerow([dict_a[sid1], dict_b[sid2]])
-                else:
-                    writer.writerow([dict_a[sid2], dict_b[sid1]])
-            elif sid2 in dict_a and sid1 in dict_b:
-                key = tuple(sorted([sid1, sid2]))
-                if key in seen:
-                    continue
-                seen.add(key)
-                if a_first:
-                    writer.writerow([dict_a[sid2], dict_b[sid1]])
-                else:
-                    writer.writerow([dict_a[sid1], dict_b[sid2]])
+    if max_hops > 1:
+        _write_hop_pairs(links_tar_filename, dict_a, dict_b, output_filename, a_first, max_hops, output_format,
+                         shards, compression, splits, dedup)
+        return
+    links, (ids_a, ids_b) = _iter_link_ids(links_tar_filename, dict_a, dict_b)
+    rows = _iter_pair_rows(links, ids_a, ids_b, a_first)
+    group = None
+    if splits:
+        rows = list(rows)
+        group = split_groups(rows)
+    with open_pair_writer(output_filename, ("LangA", "LangB"), output_format, shards=shards,
+                          compression=compression, splits=splits, dedup=dedup) as writer:
+        for sid_a, sid_b in rows:
+            writer.write(sid_a, dict_a[str(sid_a)], sid_b, dict_b[str(sid_b)], group(sid_a) if group else None)
     print(f"Wrote sentence pairs to {output_filename}.")
+
+def _iter_pair_rows(links, ids_a, ids_b, a_first):
+    """Yield the (ids_a ID, ids_b ID) rows of write_sentence_pairs, skipping duplicate pairs."""
+    seen = PairKeySet()  # Unordered ID pairs packed into 64-bit keys.
+    for sid1, sid2 in links:
+        if sid1 in ids_a and sid2 in ids_b:
+            if not seen.add(int(sid1), int(sid2)):
+                continue
+            if a_first:
+                yield sid1, sid2
+            else:
+                yield sid2, sid1
+        elif sid2 in ids_a and sid1 in ids_b:
+            if not seen.add(int(sid1), int(sid2)):
+                continue
+            if a_first:
+                yield sid2, sid1
+            else:
+                yield sid1, sid2
+
+def _write_hop_pairs(links, dict_a, dict_b, output_filename, a_first, max_hops, output_format,
+                     shards=1, compression=None, splits=None, dedup=False):
+    graph = load_link_graph(links)
+    pairs = hop_pairs(graph, (int(sid) for sid in dict_a), (int(sid) for sid in dict_b), max_hops)
+    group = split_groups(pairs) if splits else None
+    with open_pair_writer(output_filename, ("LangA", "LangB"), output_format, shards=shards,
+                          compression=compression, splits=splits, dedup=dedup) as writer:
+        for sid_a, sid_b in pairs:
+            row = (sid_a, dict_a[str(sid_a)], sid_b, dict_b[str(sid_b)])
+            writer.write(*(row if a_first else row[2:] + row[:2]), group(sid_a) if group else None)
+    print(f"Wrote {len(pairs)} sentence pairs (up to {max_hops} hops) to {output_filename}.")
+
+def write_translation_clusters(links_tar_filename, sentence_dicts, output_filename):
+    """
+    Writes the translation clusters of the sentences in sentence_dicts (lang -> sentence
+    dict) to output_filename as JSON Lines: one record per connected group of sentences,
+    mapping each language to its texts (see clusters.py), instead of one row per pair.
+    The first language of sentence_dicts is the pivot: as in clusters.py, only the links
+    between a pivot sentence and a sentence of another language join sentences.
+    The links are read once, into an array-backed union-find.
+    links_tar_filename may also be a LinkTable.
+    Returns the number of clusters.
+    """
+    langs = list(sentence_dicts)
+    links, (pivot_ids, *partner_ids) = _iter_link_ids(links_tar_filename, *sentence_dicts.values())
+    union_find = UnionFind()
+    for sid1, sid2 in links:
+        if sid1 in pivot_ids:
+            other = sid2
+        elif sid2 in pivot_ids:
+            other = sid1
+        else:
+            continue
+        if clusters.lang_index(other, partner_ids) != -1:
+            union_find.union(int(sid1), int(sid2))
+    members = [(lang, [int(sid) for sid in sentence_dicts[lang]]) for lang in langs]
+    grouped = clusters.group_clusters(union_find, members)
+    return clusters.write_clusters(grouped, lambda lang, sid: sentence_dicts[lang][str(sid)], langs,
+                                   output_filename)
+
+def write_pivot_pairs(sentences_tar_filename, links_tar_filename, pivot_lang, partner_langs, output_filenames,
+                      workers=1, memory_limit=None, output_format="tsv", shards=1, compression=None,
+                      splits=None, dedup=False):
+    """
+    Writes the sentence pairs of every language in partner_langs against pivot_lang,
+    one TSV per partner (output_filenames maps each partner to its file; columns
+    LangA = partner, LangB = pivot), with a single scan of the sentences file and a
+    single scan of the links file for all partners together (see planner.py).
+    If memory_limit (bytes) is given, sentences and pairs are spilled to sorted
+    temporary runs and joined by merging them (see external_join.py), for pairs
+    too large to hold in memory.
+    output_format is "tsv", "parquet" or "arrow"; shards, compression, splits and dedup
+    are as in write_sentence_pairs (see pair_output.py).
+    Returns the number of scans made.
+    """
+    partner_langs = list(partner_langs)
+    sentence_sources = dict.fromkeys([pivot_lang] + partner_langs, sentences_tar_filename)
+    link_sources = dict.fromkeys(partner_langs, links_tar_filename)
+    if memory_limit is not None:
+        return external_join.extract_pivot_pairs(sentence_sources, link_sources, pivot_lang, partner_langs,
+                                                 output_filenames, workers=workers, memory_limit=memory_limit,
+                                                 output_format=output_format, shards=shards,
+                                                 compression=compression, splits=splits, dedup=dedup)
+    return planner.extract_pivot_pairs(sentence_sources, link_sources, pivot_lang, partner_langs,
+                                       output_filenames, workers=workers, output_format=output_format,
+                                       shards=shards, compression=compression, splits=splits,
+                                       dedup=dedup)
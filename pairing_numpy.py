@@ -0,0 +1,87 @@
+# pairing_numpy.py
+"""
+Vectorized pairing backend
+
+Drop-in alternatives to pairing.build_candidate_ids and pairing.write_sentence_pairs
+that hold the links and the sentence IDs as NumPy int64 arrays and replace the
+per-link Python loop with array-wide membership tests (np.isin), a vectorized
+semi-join and a packed-key deduplication. Text is only looked up for the links
+that match. The output is identical to the pure Python backend.
+
+Requires NumPy (pip install numpy), which is otherwise not needed by the toolkit.
+"""
+
+import csv
+
+import numpy as np
+
+from link_table import LinkTable, load_link_table
+
+def link_arrays(links):
+    """
+    Return the links as two int64 arrays (sources, targets).
+    links is a LinkTable (its arrays are shared, not copied) or a links archive.
+    """
+    if not isinstance(links, LinkTable):
+        links = load_link_table(links)
+    return (np.frombuffer(links.sources, dtype=np.int64),
+            np.frombuffer(links.targets, dtype=np.int64))
+
+def id_array(sentences):
+    """Return the keys of a sentence_id -> text dict (or any iterable of IDs) as a sorted int64 array."""
+    ids = np.fromiter((int(sid) for sid in sentences), dtype=np.int64, count=len(sentences))
+    ids.sort()
+    return ids
+
+def build_candidate_ids(links, ref_dict, other_lang):
+    """
+    Same as pairing.build_candidate_ids, with one membership test over all links at once.
+    Returns a set of candidate sentence IDs (as str, like the Python backend).
+    """
+    sources, targets = link_arrays(links)
+    ref_ids = id_array(ref_dict)
+    src_in = np.isin(sources, ref_ids)
+    dst_in = np.isin(targets, ref_ids)
+    candidates = np.unique(np.concatenate((targets[src_in & ~dst_in], sources[dst_in & ~src_in])))
+    candidate_ids = set(map(str, candidates.tolist()))
+    print(f"Identified {len(candidate_ids)} candidate sentence IDs for language '{other_lang}'.")
+    return candidate_ids
+
+def matching_pairs(sources, targets, a_ids, b_ids):
+    """
+    Semi-join the links against two sorted ID arrays.
+    Returns (a, b) int64 arrays with one entry per unordered pair, in the order of
+    the first link producing it; links with a in sources take precedence, like the
+    if/elif in pairing.write_sentence_pairs.
+    """
+    forward = np.isin(sources, a_ids) & np.isin(targets, b_ids)
+    backward = ~forward & np.isin(targets, a_ids) & np.isin(sources, b_ids)
+    rows = np.flatnonzero(forward | backward)
+    is_forward = forward[rows]
+    a = np.where(is_forward, sources[rows], targets[rows])
+    b = np.where(is_forward, targets[rows], sources[rows])
+    low = np.minimum(a, b)
+    high = np.maximum(a, b)
+    if len(rows) and high.max() < (1 << 32) and low.min() >= 0:
+        keys = (low << 32) | high
+        _, first = np.unique(keys, return_index=True)
+    else:
+        _, first = np.unique(np.stack((low, high), axis=1), axis=0, return_index=True)
+    first.sort()
+    return a[first], b[first]
+
+def write_sentence_pairs(links, dict_a, dict_b, output_filename, a_first=True):
+    """
+    Same as pairing.write_sentence_pairs, with the join and deduplication done on
+    int64 arrays; dict_a and dict_b are only read for the pairs that are written.
+    """
+    sources, targets = link_arrays(links)
+    a, b = matching_pairs(sources, targets, id_array(dict_a), id_array(dict_b))
+    with open(output_filename, "w", encoding="utf-8", newline="") as f_out:
+        writer = csv.writer(f_out, delimiter="\t")
+        writer.writerow(["LangA", "LangB"])
+        if not a_first:
+            a, b = b, a
+        for sid_a, sid_b in zip(a.tolist(), b.tolist()):
+            writer.writerow([dict_a[str(sid_a)], dict_b[str(sid_b)]])
+    print(f"Wrote sentence pairs to {output_filename}.")
@@ -0,0 +1,181 @@
+# parallel_bz2.py
+"""
+Parallel Block-Level bzip2 Decoding
+
+A bzip2 stream is a sequence of independently compressed blocks, each one
+starting with the 48-bit magic 0x314159265359 (not byte aligned). This module
+locates the block boundaries, wraps each block into a minimal one-block bzip2
+stream and decodes the blocks in a process pool. The decompressed bytes are
+handed back strictly in order, through ParallelBZ2Reader, a read-only file
+object that can be given to tarfile.open(fileobj=..., mode="r|").
+"""
+
+import bz2
+import io
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+BLOCK_MAGIC = 0x314159265359
+EOS_MAGIC = 0x177245385090
+SCAN_CHUNK_SIZE = 1 << 24
+_MAGIC_MASK = (1 << 48) - 1
+
+def _needles(magic):
+    """
+    For each bit shift 0..7, place the magic at that bit offset in a 7-byte window
+    and return the 5 bytes (window[1:6]) that are fully determined by the magic.
+    """
+    return [(shift, (magic << (8 - shift)).to_bytes(7, "big")[1:6]) for shift in range(8)]
+
+_BLOCK_NEEDLES = _needles(BLOCK_MAGIC)
+_EOS_NEEDLES = _needles(EOS_MAGIC)
+
+def _find_magic(buf, needles, magic, limit):
+    """Return the bit offsets of magic in buf, for windows starting before byte limit."""
+    found = []
+    for shift, needle in needles:
+        pos = buf.find(needle, 1)
+        while pos != -1:
+            start = pos - 1
+            if start >= limit:
+                break
+            window = int.from_bytes(buf[start:start + 7], "big")
+            if (window >> (8 - shift)) & _MAGIC_MASK == magic:
+                found.append(start * 8 + shift)
+            pos = buf.find(needle, pos + 1)
+    return found
+
+def iter_boundaries(filename, chunk_size=SCAN_CHUNK_SIZE):
+    """
+    Generator that yields (bit_offset, is_block) for every block magic (is_block=True)
+    and end-of-stream magic (is_block=False) in the file, in increasing order.
+    """
+    with open(filename, "rb") as f:
+        base = 0
+        buf = b""
+        while True:
+            chunk = f.read(chunk_size)
+            buf += chunk
+            # A 7-byte window must fit in buf; the last 6 bytes are scanned again with the next chunk.
+            limit = len(buf) - 6 if chunk else len(buf)
+            hits = [(bit, True) for bit in _find_magic(buf, _BLOCK_NEEDLES, BLOCK_MAGIC, limit)]
+            hits += [(bit, False) for bit in _find_magic(buf, _EOS_NEEDLES, EOS_MAGIC, limit)]
+            for bit, is_block in sorted(hits):
+                yield base * 8 + bit, is_block
+            if not chunk:
+                return
+            keep = max(limit, 0)
+            base += keep
+            buf = buf[keep:]
+
+def iter_segments(filename, chunk_size=SCAN_CHUNK_SIZE):
+    """
+    Generator that yields (start_bit, end_bit, is_block) for each stretch between two
+    consecutive boundaries. Stretches starting at a block magic hold one compressed
+    block; the others are stream trailers and headers, kept so that a block split by
+    a false boundary can be merged with whatever follows it.
+    """
+    previous = None
+    for bit, is_block in iter_boundaries(filename, chunk_size):
+        if previous is not None:
+            yield previous[0], bit, previous[1]
+        previous = (bit, is_block)
+    if previous is not None and previous[1]:
+        raise Exception(f"No end-of-stream marker after the last block of {filename}.")
+
+def decode_segment(filename, start_bit, end_bit):
+    """
+    Decode the single bzip2 block stored in the bits [start_bit, end_bit) of filename.
+    The bits are re-aligned behind a "BZh9" header and closed with an end-of-stream
+    marker whose combined CRC is the block's own CRC.
+    """
+    first = start_bit // 8
+    last = (end_bit + 7) // 8
+    with open(filename, "rb") as f:
+        f.seek(first)
+        data = f.read(last - first)
+    nbits = end_bit - start_bit
+    value = (int.from_bytes(data, "big") >> (last * 8 - end_bit)) & ((1 << nbits) - 1)
+    block_crc = (value >> (nbits - 80)) & 0xFFFFFFFF
+    value = (((value << 48) | EOS_MAGIC) << 32) | block_crc
+    nbits += 80
+    pad = -nbits % 8
+    return bz2.decompress(b"BZh9" + (value << pad).to_bytes((nbits + pad) // 8, "big"))
+
+def _decode_or_none(filename, start_bit, end_bit):
+    try:
+        return decode_segment(filename, start_bit, end_bit)
+    except (OSError, EOFError, ValueError):
+        return None
+
+def iter_decompressed(filename, workers=None, chunk_size=SCAN_CHUNK_SIZE):
+    """
+    Generator that yields the decompressed content of a bzip2 file block by block,
+    in order, decoding up to 2 * workers blocks ahead in a process pool.
+    A block that fails to decode (a magic number occurring by chance inside
+    compressed data) is merged with the following stretch and decoded again.
+    """
+    workers = workers or os.cpu_count() or 1
+    segments = iter_segments(filename, chunk_size)
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        def fill():
+            while len(pending) < 2 * workers:
+                seg = next(segments, None)
+                if seg is None:
+                    return
+                start, end, is_block = seg
+                future = pool.submit(_decode_or_none, filename, start, end) if is_block else None
+                pending.append((start, end, future))
+        try:
+            fill()
+            while pending:
+                start, end, future = pending.popleft()
+                if future is None:
+                    continue
+                data = future.result()
+                while data is None:
+                    fill()
+                    if not pending:
+                        raise Exception(f"Could not decode the bzip2 block at bit {start} of {filename}.")
+                    _, end, next_future = pending.popleft()
+                    if next_future is not None:
+                        next_future.cancel()
+                    data = _decode_or_none(filename, start, end)
+                yield data
+                fill()
+        finally:
+            for _, _, future in pending:
+                if future is not None:
+                    future.cancel()
+
+class ParallelBZ2Reader(io.RawIOBase):
+    """Read-only, forward-only file object over the output of iter_decompressed."""
+
+    def __init__(self, filename, workers=None):
+        self._chunks = iter_decompressed(filename, workers)
+        self._buffer = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._buffer = memoryview(chunk)
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._chunks.close()
+        super().close()
+
+def open_parallel(filename, workers=None, buffer_size=1 << 20):
+    """Return a buffered binary reader that decodes filename with parallel_bz2."""
+    return io.BufferedReader(ParallelBZ2Reader(filename, workers), buffer_size)
@@ -0,0 +1,178 @@
+# planner.py
+"""
+Two-Pass Pair Extraction
+
+get_tatoeba_corpus used to read the sentences twice (source language, then
+target-language candidates) and the links twice (candidates, then pairs). This
+module produces the same pairs TSV with one scan of each input:
+
+1. One sentence scan collects both languages. Each language is kept as a compact
+   ID bitmap (one bit per sentence ID) plus its texts packed in a UTF-8 blob.
+2. One links scan tests both ends of every link against the bitmaps and keeps
+   the matched pairs in memory, deduplicated, in link order. The texts of the
+   matched pairs are then read from the blobs to write the TSV.
+
+Several pairs sharing a pivot language (eng–kab, fra–kab, ...) are extracted
+together by the same two scans. When languages come from different files
+(per-language exports), each file is still scanned once.
+"""
+
+from array import array
+from bisect import bisect_left
+
+from extractor import is_tar_path, iter_link_batches
+from id_sets import IdBitmap, PairKeySet
+from pair_output import open_pair_writer, split_groups
+from shards import iter_sentences_by_lang
+
+class SentenceTexts:
+    """The sentences of one language: an IdBitmap of their IDs and their texts in one blob."""
+
+    def __init__(self, lang):
+        self.lang = lang
+        self.ids = IdBitmap()
+        self._order = array('q')        # IDs in insertion order
+        self._offsets = array('Q', [0])  # text i is blob[offsets[i]:offsets[i + 1]]
+        self._blob = bytearray()
+        self._unsorted = False
+        self._index = None               # positions sorted by ID, built if IDs came unsorted
+
+    def add(self, sid, text):
+        if self._order and sid <= self._order[-1]:
+            self._unsorted = True
+            self._index = None
+        self.ids.add(sid)
+        self._order.append(sid)
+        self._blob += text.encode('utf-8')
+        self._offsets.append(len(self._blob))
+
+    def __len__(self):
+        return len(self._order)
+
+    def __contains__(self, sid):
+        return sid in self.ids
+
+    def __iter__(self):
+        """Iterate over the sentence IDs, in the order they were added."""
+        return iter(self._order)
+
+    def text(self, sid):
+        """Return the text of sentence sid, which must be in this language."""
+        order = self._order
+        if not self._unsorted:
+            i = bisect_left(order, sid)
+        else:
+            if self._index is None:
+                self._index = array('q', sorted(range(len(order)), key=order.__getitem__))
+                self._sorted_ids = array('q', (order[i] for i in self._index))
+            i = self._index[bisect_left(self._sorted_ids, sid)]
+        return self._blob[self._offsets[i]:self._offsets[i + 1]].decode('utf-8')
+
+def collect_sentences(sentence_sources, langs, workers=1):
+    """
+    Load the sentences of langs, scanning each distinct source once.
+    sentence_sources maps each language to its source (the same archive for all of
+    them, or per-language exports). Returns ({lang: SentenceTexts}, number of scans).
+    """
+    texts = {lang: SentenceTexts(lang) for lang in langs}
+    by_source = {}
+    for lang in langs:
+        by_source.setdefault(sentence_sources[lang], []).append(lang)
+    for source, source_langs in by_source.items():
+        for sid, lang, text in iter_sentences_by_lang(source, source_langs, workers=workers):
+            texts[lang].add(int(sid), text)
+    for lang in langs:
+        print(f"Found {len(texts[lang])} sentences in '{lang}'.")
+    return texts, len(by_source)
+
+def match_pivot_links(links_source, pivot_ids, partner_ids, workers=1):
+    """
+    Scan the links once and return {partner_lang: [(partner_sid, pivot_sid), ...]} for
+    the links joining a pivot sentence (in pivot_ids) to a sentence of one of the
+    partner languages (partner_ids maps each of them to its IDs), deduplicated, in the
+    order of the full links archive.
+    A per-pair links export holds one direction of each link only: its pairs are
+    sorted by (lower ID, higher ID), which is the order the full archive yields them in.
+    """
+    partners = list(partner_ids.items())
+    pairs = {lang: [] for lang, _ in partners}
+    seen = {lang: PairKeySet() for lang, _ in partners}
+    for batch in iter_link_batches(links_source, workers=workers, as_int=True):
+        for sid1, sid2 in batch:
+            if sid1 in pivot_ids:
+                pivot, other = sid1, sid2
+            elif sid2 in pivot_ids:
+                pivot, other = sid2, sid1
+            else:
+                continue
+            for lang, ids in partners:
+                if other in ids:
+                    if seen[lang].add(sid1, sid2):
+                        pairs[lang].append((other, pivot))
+                    break
+    for lang, lang_pairs in pairs.items():
+        if not is_tar_path(links_source):
+            lang_pairs.sort(key=lambda pair: (min(pair), max(pair)))
+        print(f"Matched {len(lang_pairs)} sentence pairs for '{lang}'.")
+    return pairs
+
+def collect_pairs(sentence_sources, link_sources, pivot_lang, partner_langs, workers=1):
+    """
+    The two scans of extract_pivot_pairs, without writing anything. Returns
+    ({lang: SentenceTexts}, {partner_lang: [(partner_sid, pivot_sid), ...]}, number of scans).
+    """
+    texts, passes = collect_sentences(sentence_sources, [pivot_lang] + list(partner_langs), workers)
+    by_source = {}
+    for lang in partner_langs:
+        by_source.setdefault(link_sources[lang], []).append(lang)
+    pairs = {}
+    for source, langs in by_source.items():
+        pairs.update(match_pivot_links(source, texts[pivot_lang].ids,
+                                       {lang: texts[lang].ids for lang in langs}, workers))
+    return texts, pairs, passes + len(by_source)
+
+def write_pivot_pairs(texts, pairs, pivot_lang, partner_langs, output_filenames, headers=None,
+                      output_format="tsv", shards=1, compression=None, splits=None, dedup=False):
+    """Write the pairs returned by collect_pairs (see extract_pivot_pairs for the options)."""
+    pivot_texts = texts[pivot_lang]
+    for lang in partner_langs:
+        header = (headers or {}).get(lang, ("LangA", "LangB"))
+        group = split_groups(pairs[lang]) if splits else None
+        with open_pair_writer(output_filenames[lang], header, output_format, shards=shards,
+                              compression=compression, splits=splits, dedup=dedup) as writer:
+            for sid, pivot_sid in pairs[lang]:
+                writer.write(sid, texts[lang].text(sid), pivot_sid, pivot_texts.text(pivot_sid),
+                             group(sid) if group else None)
+        print(f"Wrote sentence pairs to {output_filenames[lang]}.")
+
+def extract_pivot_pairs(sentence_sources, link_sources, pivot_lang, partner_langs, output_filenames,
+                        headers=None, workers=1, output_format="tsv", shards=1, compression=None,
+                        splits=None, dedup=False):
+    """
+    Write one TSV per partner language (output_filenames maps each partner to its file)
+    with its sentence pairs against pivot_lang: partner text first, pivot text second.
+    sentence_sources maps every language to its sentences source and link_sources maps
+    every partner to its links source; each distinct source is scanned once, so the
+    full archives cost one sentence scan and one links scan for all partners together.
+    headers optionally maps each partner to its TSV header row (default: LangA, LangB).
+    output_format is "tsv", "parquet" or "arrow"; with shards > 1, each output is a
+    directory of that many compressed TSV shards. With splits ({name: fraction}),
+    each pair goes to a train/dev/test... file by a stable hash of its cluster of
+    pairs (see pair_output.py). With dedup, pairs whose normalized texts repeat an
+    earlier pair's are dropped while writing.
+    Returns the number of scans made over the inputs.
+    """
+    texts, pairs, passes = collect_pairs(sentence_sources, link_sources, pivot_lang, partner_langs, workers)
+    write_pivot_pairs(texts, pairs, pivot_lang, partner_langs, output_filenames, headers,
+                      output_format, shards, compression, splits, dedup)
+    return passes
+
+def extract_pairs(sentence_sources, links_source, lang_a, lang_b, output_filename,
+                  header=("LangA", "LangB"), workers=1, output_format="tsv"):
+    """
+    Write the lang_a / lang_b sentence pairs to output_filename (TSV, one column per
+    language) with one sentence scan and one links scan.
+    Returns the number of scans made over the inputs.
+    """
+    return extract_pivot_pairs(sentence_sources, {lang_a: links_source}, lang_b, [lang_a],
+                               {lang_a: output_filename}, {lang_a: header}, workers, output_format)
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Memory-Mapped Sentence Store
+
+Tatoeba sentence IDs are dense integers, so the sentences export can be stored
+as one UTF-8 text blob plus arrays indexed directly by sentence ID:
+
+    texts.bin    all sentence texts, concatenated
+    starts.bin   uint64 offset of each sentence's text in texts.bin
+    lengths.bin  uint32 byte length of each text (0: no such sentence)
+    langs.bin    uint16 language number of each sentence (see meta.json)
+    meta.json    languages, per-language counts, and the archive size/mtime
+
+The files are opened with mmap, so opening the store costs milliseconds and
+get(sid) / get_many(sids) are O(1) per ID. store.language("eng") is a read-only,
+dict-like view that pairing.write_sentence_pairs accepts in place of a sentence
+dict, resolving text only for the links that match.
+
+Usage as a command-line tool:
+    python3 sentence_store.py --sentences_tar sentences.tar.bz2
+    python3 sentence_store.py --sentences_tar sentences.tar.bz2 --get 1234 5678
+"""
+
+import argparse
+import json
+import mmap
+import os
+import sys
+from array import array
+
+from extractor import archive_key, iter_sentences
+
+STORE_DIR_SUFFIX = ".store"
+META_NAME = "meta.json"
+
+def store_dir(tar_filename, output_dir=None):
+    """Return the directory of the sentence store for tar_filename (next to it by default)."""
+    return output_dir or os.path.abspath(tar_filename) + STORE_DIR_SUFFIX
+
+def build_store(tar_filename, output_dir=None, workers=1):
+    """
+    Build the sentence store for tar_filename in one pass over the sentences file.
+    Returns the store directory.
+    """
+    directory = store_dir(tar_filename, output_dir)
+    os.makedirs(directory, exist_ok=True)
+    meta_path = os.path.join(directory, META_NAME)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    size, mtime_ns = archive_key(tar_filename)
+    starts = array('Q')
+    lengths = array('I')
+    langs = array('H')
+    lang_numbers = {}
+    counts = {}
+    offset = 0
+    max_id = -1
+    with open(os.path.join(directory, "texts.bin"), "wb") as blob:
+        for sid, lang, text in iter_sentences(tar_filename, workers=workers):
+            sid = int(sid)
+            max_id = max(max_id, sid)
+            if sid >= len(starts):
+                # Grow the ID-indexed columns geometrically.
+                new_size = max(sid + 1, 2 * len(starts))
+                for column in (starts, lengths, langs):
+                    column.frombytes(bytes(column.itemsize * (new_size - len(column))))
+            number = lang_numbers.get(lang)
+            if number is None:
+                number = lang_numbers[lang] = len(lang_numbers) + 1
+                counts[lang] = 0
+            data = text.encode('utf-8')
+            blob.write(data)
+            starts[sid] = offset
+            lengths[sid] = len(data)
+            langs[sid] = number
+            counts[lang] += 1
+            offset += len(data)
+    for name, column in (("starts.bin", starts), ("lengths.bin", lengths), ("langs.bin", langs)):
+        with open(os.path.join(directory, name), "wb") as f:
+            column[:max_id + 1].tofile(f)
+    meta = {
+        "archive": {"name": os.path.basename(tar_filename), "size": size, "mtime_ns": mtime_ns},
+        "byteorder": sys.byteorder,
+        "max_id": max_id,
+        "languages": sorted(lang_numbers, key=lang_numbers.get),
+        "counts": counts,
+    }
+    # meta.json is written last: its presence marks a complete store.
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2, ensure_ascii=False)
+    return directory
+
+def _map(path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+class SentenceStore:
+    """Read-only access to a store written by build_store."""
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, META_NAME), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta["byteorder"] != sys.byteorder:
+            raise Exception(f"{directory} was built on a machine with a different byte order.")
+        self.languages = [None] + self.meta["languages"]
+        self._lang_numbers = {lang: n for n, lang in enumerate(self.languages) if n}
+        self._maps = []
+        self._texts = self._open(directory, "texts.bin", "B")
+        self._starts = self._open(directory, "starts.bin", "Q")
+        self._lengths = self._open(directory, "lengths.bin", "I")
+        self._langs = self._open(directory, "langs.bin", "H")
+        self._size = len(self._langs)
+
+    def _open(self, directory, name, typecode):
+        mm = _map(os.path.join(directory, name))
+        raw = memoryview(mm if mm is not None else b"")
+        view = raw.cast(typecode)
+        self._maps.append((view, raw, mm))
+        return view
+
+    def close(self):
+        for view, raw, mm in self._maps:
+            view.release()
+            raw.release()
+            if mm is not None:
+                mm.close()
+        self._maps = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return sum(self.meta["counts"].values())
+
+    def __contains__(self, sid):
+        sid = int(sid)
+        return 0 <= sid < self._size and self._langs[sid] != 0
+
+    def lang(self, sid):
+        """Return the language of sentence sid, or None if there is no such sentence."""
+        sid = int(sid)
+        if 0 <= sid < self._size:
+            return self.languages[self._langs[sid]]
+        return None
+
+    def get(self, sid, default=None):
+        """Return the text of sentence sid (str or int), or default if there is no such sentence."""
+        sid = int(sid)
+        if not (0 <= sid < self._size) or self._langs[sid] == 0:
+            return default
+        start = self._starts[sid]
+        return bytes(self._texts[start:start + self._lengths[sid]]).decode('utf-8')
+
+    def get_many(self, sids, default=None):
+        """Return the texts of the sentences in sids, in order (default for missing ones)."""
+        return [self.get(sid, default) for sid in sids]
+
+    def language(self, lang):
+        """Return a dict-like view of the sentences in lang."""
+        return LanguageView(self, lang)
+
+class LanguageView:
+    """
+    The sentences of one language in a SentenceStore, usable where pairing expects
+    a sentence_id -> text dict: membership tests and lookups accept str or int IDs,
+    and iteration yields str IDs.
+    """
+
+    def __init__(self, store, lang):
+        self.store = store
+        self.lang = lang
+        self._number = store._lang_numbers.get(lang, -1)
+
+    def __contains__(self, sid):
+        sid = int(sid)
+        return 0 <= sid < self.store._size and self.store._langs[sid] == self._number
+
+    def __getitem__(self, sid):
+        if sid not in self:
+            raise KeyError(sid)
+        return self.store.get(sid)
+
+    def get(self, sid, default=None):
+        return self[sid] if sid in self else default
+
+    def __len__(self):
+        return self.store.meta["counts"].get(self.lang, 0)
+
+    def __iter__(self):
+        number = self._number
+        for sid, n in enumerate(self.store._langs):
+            if n == number:
+                yield str(sid)
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        for sid in self:
+            yield sid, self.store.get(sid)
+
+def open_store(tar_filename, output_dir=None):
+    """Open the sentence store for tar_filename, or return None if it is missing or stale."""
+    directory = store_dir(tar_filename, output_dir)
+    try:
+        with open(os.path.join(directory, META_NAME), encoding="utf-8") as f:
+            archive = json.load(f)["archive"]
+        if (archive["size"], archive["mtime_ns"]) != archive_key(tar_filename):
+            return None
+    except (OSError, ValueError, KeyError):
+        return None
+    return SentenceStore(directory)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query a memory-mapped Tatoeba sentence store.")
+    parser.add_argument("--sentences_tar", default="sentences.tar.bz2",
+                        help="Sentences archive (default: sentences.tar.bz2)")
+    parser.add_argument("--output_dir", default=None,
+                        help="Store directory (default: <archive>.store next to the archive)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processes for parallel bz2 decoding (default: 1)")
+    parser.add_argument("--get", nargs="+", metavar="ID",
+                        help="Print the language and text of these sentence IDs instead of building")
+    args = parser.parse_args()
+
+    if args.get:
+        store = open_store(args.sentences_tar, args.output_dir)
+        if store is None:
+            raise SystemExit("No up-to-date store for this archive; build it first.")
+        with store:
+            for sid in args.get:
+                print(f"{sid}\t{store.lang(sid)}\t{store.get(sid)}")
+    else:
+        directory = build_store(args.sentences_tar, args.output_dir, args.workers)
+        print(f"Sentence store written to {directory}.")
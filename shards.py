@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Language Shard Store
+
+Splits the sentences file of a Tatoeba export into one gzip file per language
+(kab.tsv.gz, eng.tsv.gz, ...) plus a manifest.json recording, for each language,
+its row count, its uncompressed and compressed size and its sentence ID range.
+Readers that only need a few languages then decompress a few MB instead of the
+whole export.
+
+The store lives next to the archive (sentences.tar.bz2.shards/) and is keyed by
+the archive's size and mtime, so it is ignored once the archive is re-downloaded.
+
+Usage as a command-line tool (run once per downloaded export):
+    python3 shards.py --sentences_tar sentences.tar.bz2
+"""
+
+import argparse
+import gzip
+import heapq
+import json
+import os
+from urllib.parse import quote
+
+from extractor import archive_key, is_archive_path, iter_member_blocks, iter_sentences
+
+SHARD_DIR_SUFFIX = ".shards"
+MANIFEST_NAME = "manifest.json"
+
+def shard_dir(tar_filename, output_dir=None):
+    """Return the directory of the shard store for tar_filename (next to it by default)."""
+    return output_dir or os.path.abspath(tar_filename) + SHARD_DIR_SUFFIX
+
+def build_shards(tar_filename, output_dir=None, workers=1, compresslevel=6):
+    """
+    Split the sentences file of tar_filename into one gzip shard per language and
+    write the manifest. Lines are copied as-is (id, lang, text) without decoding.
+    Returns the manifest.
+    """
+    directory = shard_dir(tar_filename, output_dir)
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    size, mtime_ns = archive_key(tar_filename)
+    outputs = {}
+    languages = {}
+    try:
+        for lines in iter_member_blocks(tar_filename, "sentences", "sentences", workers):
+            for line in lines:
+                parts = line.split(b"\t", 2)
+                if len(parts) < 3:
+                    continue
+                lang = parts[1]
+                out = outputs.get(lang)
+                if out is None:
+                    name = quote(lang.decode('utf-8'), safe="") + ".tsv.gz"
+                    out = outputs[lang] = gzip.open(os.path.join(directory, name), "wb", compresslevel)
+                    languages[lang] = {"file": name, "rows": 0, "bytes": 0,
+                                       "min_id": int(parts[0]), "max_id": int(parts[0])}
+                out.write(line + b"\n")
+                info = languages[lang]
+                info["rows"] += 1
+                info["bytes"] += len(line) + 1
+                info["max_id"] = max(info["max_id"], int(parts[0]))
+    finally:
+        for out in outputs.values():
+            out.close()
+    for info in languages.values():
+        info["compressed_bytes"] = os.path.getsize(os.path.join(directory, info["file"]))
+    manifest = {
+        "archive": {"name": os.path.basename(tar_filename), "size": size, "mtime_ns": mtime_ns},
+        "languages": {lang.decode('utf-8'): info for lang, info in sorted(languages.items())},
+    }
+    # The manifest is written last: its presence marks a complete store.
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    return manifest
+
+def load_manifest(tar_filename, output_dir=None):
+    """Return the manifest of the shard store for tar_filename, or None if it is missing or stale."""
+    manifest_path = os.path.join(shard_dir(tar_filename, output_dir), MANIFEST_NAME)
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        key = (manifest["archive"]["size"], manifest["archive"]["mtime_ns"])
+        if key != archive_key(tar_filename):
+            return None
+    except (OSError, ValueError, KeyError):
+        return None
+    return manifest
+
+def _iter_shard(path):
+    with gzip.open(path, "rb") as f:
+        for line in f:
+            parts = line.decode('utf-8').rstrip("\n").split("\t")
+            if len(parts) < 3:
+                continue
+            yield parts[0], parts[1], parts[2]
+
+def iter_sentences_by_lang(tar_filename, langs, output_dir=None, workers=1):
+    """
+    Generator that yields (sentence_id, lang, text) for the sentences in langs
+    (a language code or a collection of them), in the order of the sentences file.
+    Reads only the needed shards when a valid store exists for tar_filename, and
+    falls back to extractor.iter_sentences otherwise.
+    """
+    if isinstance(langs, str):
+        langs = [langs]
+    manifest = load_manifest(tar_filename, output_dir) if is_archive_path(tar_filename) else None
+    if manifest is None:
+        yield from iter_sentences(tar_filename, workers=workers, langs=langs)
+        return
+    directory = shard_dir(tar_filename, output_dir)
+    shards = [_iter_shard(os.path.join(directory, manifest["languages"][lang]["file"]))
+              for lang in sorted(set(langs)) if lang in manifest["languages"]]
+    yield from heapq.merge(*shards, key=lambda row: int(row[0]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split a Tatoeba sentences export into per-language shards.")
+    parser.add_argument("--sentences_tar", default="sentences.tar.bz2",
+                        help="Sentences archive (default: sentences.tar.bz2)")
+    parser.add_argument("--output_dir", default=None,
+                        help="Shard directory (default: <archive>.shards next to the archive)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processes for parallel bz2 decoding (default: 1)")
+    args = parser.parse_args()
+
+    manifest = build_shards(args.sentences_tar, args.output_dir, args.workers)
+    total = sum(info["rows"] for info in manifest["languages"].values())
+    print(f"Wrote {total} sentences in {len(manifest['languages'])} language shards "
+          f"to {shard_dir(args.sentences_tar, args.output_dir)}.")
@@ -0,0 +1,205 @@
+# test_downloader.py
+"""Range downloads against a local HTTP server with Range and ETag support."""
+
+import bz2
+import io
+import json
+import os
+import random
+import re
+import tarfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import downloader
+import planner
+
+RANGE_SIZE = 1000
+DATA = random.Random(0).randbytes(10 * RANGE_SIZE + 500)  # 11 ranges, the last one short
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """
+    Serves server.files[path], or server.data at any other path. Range requests get a 206 unless the server
+    ignores them (server.ranges False), or a 503 while server.failures is set and
+    server.failures ranges have already been served. With server.short, ranges
+    are answered with their first half only.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        data = server.files.get(self.path, server.data)
+        etag = server.etag
+        if etag and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        match = re.fullmatch(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+        if match and server.ranges:
+            with server.lock:
+                server.range_requests += 1
+                failing = server.failures is not None and server.served >= server.failures
+                if not failing:
+                    server.served += 1
+            if failing:
+                self.send_error(503)
+                return
+            start, end = int(match[1]), min(int(match[2]), len(data) - 1)
+            if server.short:
+                end = start + (end - start) // 2
+            body = data[start:end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        else:
+            body = data
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        if server.advertise_ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if etag:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    server.data = DATA
+    server.files = {}
+    server.etag = '"v1"'
+    server.ranges = server.advertise_ranges = True
+    server.short = False
+    server.failures = None
+    server.served = server.range_requests = 0
+    server.lock = threading.Lock()
+    server.url = f"http://127.0.0.1:{server.server_port}/links.tar.bz2"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def test_download_file_by_ranges(server, tmp_path):
+    filename = str(tmp_path / "links.tar.bz2")
+    assert downloader.download_file(server.url, filename, workers=3, range_size=RANGE_SIZE)
+    assert read(filename) == DATA
+    assert server.range_requests == 11
+    assert not os.path.exists(filename + downloader.PART_SUFFIX)
+    assert not os.path.exists(filename + downloader.RANGES_SUFFIX)
+    with open(tmp_path / downloader.MANIFEST_NAME, encoding="utf-8") as f:
+        entry = json.load(f)["links.tar.bz2"]
+    assert (entry["etag"], entry["size"]) == ('"v1"', len(DATA))
+    # Unchanged on the server: answered by a 304, nothing fetched again.
+    assert not downloader.download_file(server.url, filename, workers=3, range_size=RANGE_SIZE)
+    assert server.range_requests == 11
+
+def test_resume_after_server_errors(server, tmp_path):
+    filename = str(tmp_path / "links.tar.bz2")
+    server.failures = 4
+    with pytest.raises(requests.HTTPError):
+        downloader.download_file(server.url, filename, workers=2, range_size=RANGE_SIZE)
+    assert not os.path.exists(filename)
+    assert downloader.has_pending_ranges(filename)
+    done = downloader._load_ranges(filename, server.url, len(DATA), RANGE_SIZE,
+                                   {"etag": '"v1"', "last_modified": None})
+    assert 3 <= len(done) < 11
+    server.failures = None
+    server.range_requests = 0
+    assert downloader.download_file(server.url, filename, workers=2, range_size=RANGE_SIZE)
+    assert server.range_requests == 11 - len(done)
+    assert read(filename) == DATA
+    assert not downloader.has_pending_ranges(filename)
+
+def test_server_ignoring_ranges(server, tmp_path):
+    filename = str(tmp_path / "links.tar.bz2")
+    server.ranges = False
+    with pytest.raises(Exception, match="ignored the range request"):
+        downloader.download_ranges(server.url, filename, len(DATA), workers=2, range_size=RANGE_SIZE)
+    assert not os.path.exists(filename)
+    # Without Accept-Ranges, download_file reads the plain response instead.
+    server.advertise_ranges = False
+    assert downloader.download_file(server.url, filename, workers=2, range_size=RANGE_SIZE)
+    assert read(filename) == DATA
+
+def test_short_range_read(server, tmp_path):
+    filename = str(tmp_path / "links.tar.bz2")
+    server.short = True
+    with pytest.raises(Exception, match="was cut short"):
+        downloader.download_ranges(server.url, filename, len(DATA), workers=1, range_size=RANGE_SIZE)
+    assert not os.path.exists(filename)
+    assert downloader._load_ranges(filename, server.url, len(DATA), RANGE_SIZE, {}) == set()
+
+def test_no_validators_compares_sizes(server, tmp_path):
+    filename = str(tmp_path / "links.tar.bz2")
+    server.etag = None
+    server.advertise_ranges = False
+    assert downloader.download_file(server.url, filename)
+    # Neither the manifest nor the server has validators: same size, same file.
+    assert not downloader.download_file(server.url, filename)
+    server.data = DATA[:-1]
+    assert downloader.download_file(server.url, filename)
+    assert read(filename) == DATA[:-1]
+
+@pytest.mark.parametrize("ranges", [True, False], ids=["ranges", "stream"])
+def test_tee_reads_the_renamed_part_file(server, tmp_path, ranges):
+    # The first read comes after the part file got its final name, before _finish.
+    filename = str(tmp_path / "links.tar.bz2")
+    tee = downloader.TeeStream(filename)
+    if ranges:
+        downloader.download_ranges(server.url, filename, len(DATA), workers=2, range_size=RANGE_SIZE, tee=tee)
+    else:
+        with requests.get(server.url, stream=True) as response:
+            downloader._stream_to_file(response, filename, tee=tee)
+    assert not os.path.exists(filename + downloader.PART_SUFFIX)
+    start = tee.read(100)
+    tee._finish(filename)
+    assert start + tee.read() == DATA
+    tee.close()
+
+def write_tar(member, rows):
+    data = "".join(rows).encode("utf-8")
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        info = tarfile.TarInfo(member)
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    return bz2.compress(buffer.getvalue())
+
+def test_stream_downloads_export(server, tmp_path):
+    langs = {sid: ("kab", "eng", "fra")[sid % 3] for sid in range(1, 3001)}
+    server.files = {
+        "/sentences.tar.bz2": write_tar("sentences.csv", [f"{sid}\t{lang}\tTafyirt {sid}\n"
+                                                         for sid, lang in langs.items()]),
+        "/links.tar.bz2": write_tar("links.csv", [f"{sid}\t{sid + delta}\n" for sid in langs
+                                                 for delta in (-1, 1) if sid + delta in langs]),
+    }
+    url = server.url.rsplit("/", 1)[0]
+    downloads = {f"{url}{path}": str(tmp_path / path[1:]) for path in server.files}
+    sentences, links = (str(tmp_path / "sentences.tar.bz2"), str(tmp_path / "links.tar.bz2"))
+    tees, future = downloader.stream_downloads(downloads, workers=2)
+    planner.extract_pivot_pairs({lang: tees[sentences] for lang in ("kab", "eng")}, {"eng": tees[links]},
+                                "kab", ["eng"], {"eng": str(tmp_path / "streamed.tsv")})
+    future.result()
+    for tee in tees.values():
+        tee.close()
+    planner.extract_pivot_pairs({lang: sentences for lang in ("kab", "eng")}, {"eng": links},
+                                "kab", ["eng"], {"eng": str(tmp_path / "downloaded.tsv")})
+    assert read(tmp_path / "streamed.tsv") == read(tmp_path / "downloaded.tsv")
+    assert read(tmp_path / "streamed.tsv").count(b"\n") == 1000
+
+def test_cancel_stops_the_downloads(server, tmp_path):
+    cancel = threading.Event()
+    cancel.set()
+    filename = str(tmp_path / "links.tar.bz2")
+    with pytest.raises(downloader.DownloadCancelled):
+        downloader.download_all({server.url: filename}, workers=2, cancel=cancel)
+    assert not os.path.exists(filename)
@@ -0,0 +1,91 @@
+# test_exports.py
+"""The full archives and the per-language exports give the same pairs."""
+
+import bz2
+import io
+import random
+import tarfile
+
+import pytest
+
+import external_join
+import planner
+
+PIVOT = "kab"
+PARTNERS = ["eng", "fra"]
+
+def write_tar(path, member, rows):
+    data = "".join(rows).encode("utf-8")
+    with tarfile.open(path, "w:bz2") as tar:
+        info = tarfile.TarInfo(member)
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+
+def write_bz2(path, rows):
+    with bz2.open(path, "wt", encoding="utf-8") as f:
+        f.writelines(rows)
+
+@pytest.fixture(scope="module")
+def exports(tmp_path_factory):
+    """
+    A small Tatoeba snapshot as full archives (sentences.tar.bz2, links.tar.bz2,
+    every link in both directions) and as the per-language exports cut from it
+    (<lang>_sentences.tsv.bz2, kab-<lang>_links.tsv.bz2, one direction per link).
+    Returns (full sources, per-language sources), each a pair of
+    ({lang: sentences source}, {partner: links source}).
+    """
+    directory = tmp_path_factory.mktemp("exports")
+    rnd = random.Random(0)
+    count = 3000
+    langs = {sid: rnd.choice([PIVOT, *PARTNERS, "deu", "\\N"]) for sid in range(1, count + 1)}
+    sentences = [f"{sid}\t{lang}\tTafyirt {sid} ({lang}) ɣ ḍ {'x' * rnd.randint(0, 20)}\n"
+                 for sid, lang in langs.items()]
+    links = set()
+    for _ in range(3 * count):
+        sid1, sid2 = rnd.randint(1, count), rnd.randint(1, count)
+        if sid1 != sid2:
+            links.update([(sid1, sid2), (sid2, sid1)])
+    links = sorted(links)
+    write_tar(directory / "sentences.tar.bz2", "sentences.csv", sentences)
+    write_tar(directory / "links.tar.bz2", "links.csv", [f"{sid1}\t{sid2}\n" for sid1, sid2 in links])
+    full = ({lang: str(directory / "sentences.tar.bz2") for lang in [PIVOT, *PARTNERS]},
+            {lang: str(directory / "links.tar.bz2") for lang in PARTNERS})
+    per_language = ({}, {})
+    for lang in [PIVOT, *PARTNERS]:
+        path = directory / f"{lang}_sentences.tsv.bz2"
+        write_bz2(path, [row for row in sentences if row.split("\t")[1] == lang])
+        per_language[0][lang] = str(path)
+    for lang in PARTNERS:
+        path = directory / f"{PIVOT}-{lang}_links.tsv.bz2"
+        write_bz2(path, [f"{sid1}\t{sid2}\n" for sid1, sid2 in links
+                         if langs[sid1] == PIVOT and langs[sid2] == lang])
+        per_language[1][lang] = str(path)
+    return full, per_language
+
+def extract(extract_pivot_pairs, sources, directory, **options):
+    outputs = {lang: str(directory / f"{lang}_{PIVOT}_sentence_pairs.tsv") for lang in PARTNERS}
+    extract_pivot_pairs(*sources, PIVOT, PARTNERS, outputs, **options)
+    contents = {}
+    for lang, path in outputs.items():
+        with open(path, encoding="utf-8") as f:
+            contents[lang] = f.read()
+    return contents
+
+@pytest.mark.parametrize("extract_pivot_pairs, options", [
+    (planner.extract_pivot_pairs, {}),
+    (external_join.extract_pivot_pairs, {"memory_limit": 1 << 14}),
+], ids=["planner", "external_join"])
+def test_full_and_per_language_exports_match(exports, tmp_path, extract_pivot_pairs, options):
+    full, per_language = exports
+    (tmp_path / "full").mkdir()
+    (tmp_path / "per_language").mkdir()
+    expected = extract(extract_pivot_pairs, full, tmp_path / "full", **options)
+    assert all(contents.count("\n") > 50 for contents in expected.values())
+    assert extract(extract_pivot_pairs, per_language, tmp_path / "per_language", **options) == expected
+
+def test_planner_and_external_join_match(exports, tmp_path):
+    full, _ = exports
+    (tmp_path / "planner").mkdir()
+    (tmp_path / "external_join").mkdir()
+    assert extract(planner.extract_pivot_pairs, full, tmp_path / "planner") \
+        == extract(external_join.extract_pivot_pairs, full, tmp_path / "external_join", memory_limit=1 << 14)
@@ -0,0 +1,34 @@
+# test_pair_output.py
+"""Sharded pair output: the manifest marks a complete output."""
+
+import os
+
+import pytest
+
+import pair_output
+
+def write_pairs(path, count, fail=False, **options):
+    with pair_output.open_pair_writer(str(path), ("English", "Kabyle"), shards=4, compression="gzip",
+                                      **options) as writer:
+        for sid in range(count):
+            writer.write(sid, f"Sentence {sid}.", sid + 100000, f"Tafyirt {sid}.", sid)
+        if fail:
+            raise RuntimeError("extraction failed")
+
+def test_complete_shards(tmp_path):
+    write_pairs(tmp_path / "pairs", 1000)
+    assert os.path.exists(tmp_path / "pairs" / pair_output.MANIFEST_NAME)
+    texts = sorted(pair_output.iter_pair_texts(str(tmp_path / "pairs")))
+    assert texts == sorted((f"Sentence {sid}.", f"Tafyirt {sid}.") for sid in range(1000))
+
+@pytest.mark.parametrize("options", [{}, {"dedup": True}, {"splits": {"train": 0.9, "test": 0.1}}],
+                         ids=["plain", "dedup", "splits"])
+def test_failed_write_leaves_no_output(tmp_path, options):
+    with pytest.raises(RuntimeError):
+        write_pairs(tmp_path / "pairs.tsv", 10, fail=True, **options)
+    paths = [pair_output.split_path(str(tmp_path / "pairs.tsv"), name) for name in options["splits"]] \
+        if "splits" in options else [str(tmp_path / "pairs.tsv")]
+    for path in paths:
+        assert os.listdir(path) == []
+        with pytest.raises(FileNotFoundError):
+            list(pair_output.iter_pair_texts(path))